@@ -1,8 +1,7 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-from .main import main as main1
-from .saas import main as main2
+import sys
 
 def main():
     def parse_args():
@@ -10,11 +9,24 @@ def main():
         parser = argparse.ArgumentParser(description="Python use - AIPython")
         parser.add_argument("-c", '--config', type=str, default=None, help="Toml config file")
         parser.add_argument('-p', '--python', default=False, action='store_true', help="Python mode")
+        subparsers = parser.add_subparsers(dest='command')
+        batch = subparsers.add_parser('batch', help="Run tasks from a JSONL file in parallel")
+        batch.add_argument('tasks', type=str, help="JSONL file, one task per line")
+        batch.add_argument('-w', '--workers', type=int, default=None, help="Number of worker processes")
+        batch.add_argument('-o', '--output', type=str, default=None, help="Append JSONL results to this file instead of stdout")
+        resume = subparsers.add_parser('resume', help="Resume an interrupted task from its event log")
+        resume.add_argument('task_id', type=str, help="Task id (directory name under workdir)")
         return parser.parse_args()
     args = parse_args()
-    if args.python:
+    # 解析参数之后再导入，aipy --help 不需要加载 Agent 和 LLM 相关的模块
+    if args.command == 'batch':
+        from .batch import main as main3
+        sys.exit(main3(args))
+    elif args.python:
+        from .main import main as main1
         main1(args)
     else:
+        from .saas import main as main2
         main2(args)
 
 if __name__ == '__main__':
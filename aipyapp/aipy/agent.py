@@ -5,7 +5,7 @@ import os
 import time
 import json
 import uuid
-import requests
+from collections import Counter
 from enum import Enum
 from pathlib import Path
 
@@ -20,8 +20,16 @@ from rich.markdown import Markdown
 from . import i18n
 from . import utils
 from .i18n import T
-from .llm import LLM
-from .runner import Runner
+from .llm import LLM, ChatMessage
+from .runner import Runner, is_summary
+from .recorder import ConsoleRecorder
+from .tasklog import TaskLog
+from .tokens import estimate_tokens
+from .fence import FenceDetector
+from .serialize import compact_result, filter_stats
+from .sandbox import SubprocessRunner
+from .speculate import Speculator
+from .limits import TaskLimit
 
 class MsgType(Enum):
     CODE = "CODE"
@@ -78,10 +86,15 @@ class Agent():
         self.llm = None
         self.runner = None
         self._console = console
+        self.recorder = None
         self.system_prompt = None
         self.max_tokens = None
         self._cwd = None
         self.task_id = None
+        self.tasklog = None
+        self._logged = 0
+        self._compact = True
+        self._last_result = None
         self._init()
 
     def _init(self):
@@ -90,10 +103,24 @@ class Agent():
         if lang:
             i18n.lang = lang
         self._console = self._console or Console(record=config.get('record', True))
+        self.recorder = ConsoleRecorder.install(self._console)
         self.max_tokens = config.get('max_tokens', self.MAX_TOKENS)
         self.system_prompt = config.get('system_prompt')
-        self.runner = Runner(self._console, config)
-        self.llm = LLM(self._console,config['llm'], self.max_tokens)
+        self._compact = config.get('feedback.compact', True)
+        self._stats_time = config.get('feedback.stats_time', 10)
+        self.limit = TaskLimit(config.get('limit'))
+        # 推测执行选中的分支在工作进程里执行过代码，之后也要在工作进程里继续执行
+        self.speculator = Speculator(self._console, config) if config.get('speculate.enable') else None
+        if config.get('sandbox.enable') or self.speculator:
+            self.runner = SubprocessRunner(self._console, config)
+        else:
+            self.runner = Runner(self._console, config)
+        cache = None
+        if config.get('cache.enable'):
+            # cache 导入 sqlite3，只在启用缓存时导入
+            from .cache import CompletionCache
+            cache = CompletionCache.from_config(config.get('cache'))
+        self.llm = LLM(self._console,config['llm'], self.max_tokens, cache=cache, context=config.get('context'), hedge=config.get('hedge'), route=config.get('route'))
         self.use = self.llm.use
         if config.workdir:
             workdir = Path.cwd() / config.workdir
@@ -123,23 +150,31 @@ class Agent():
                     lines.append(f"### API {T('description')}\n{desc}")
             self.system_prompt = "\n".join(lines)
 
-    def save(self, path):
-        self._console.save_html(path, clear=False, code_format=CONSOLE_HTML_FORMAT)
+    def save(self, path, clear=False):
+        if self.recorder is not None:
+            self.recorder.save_html(path, CONSOLE_HTML_FORMAT, clear=clear)
         
     def done(self):
         #self._console.save_svg('console.svg', clear=False)
-        self._console.save_html('console.html', clear=True, code_format=CONSOLE_HTML_FORMAT)
-        task = {'instruction': self.instruction}
-        task['llm'] = self.llm.history.json()
-        task['runner'] = self.runner.history
+        self.save('console.html', clear=True)
         try:
-            json.dump(task, open('task.json', 'w'), ensure_ascii=False, indent=4)
+            if self.tasklog:
+                self.tasklog.close()
+                TaskLog.compact(self.tasklog.dir, 'task.json')
+            else:
+                task = {'instruction': self.instruction}
+                task['llm'] = self.llm.history.json()
+                task['runner'] = self.runner.history
+                json.dump(task, open('task.json', 'w'), ensure_ascii=False, indent=4)
         except Exception as e:
             self._console.print_exception()
+        self.tasklog = None
+        self._logged = 0
         self.llm.clear()
         self.runner.clear()
         self.task_id = None
         self.instruction = None
+        self._last_result = None
             
     def render_code(self, logs, language="python", max_lines=3, delay=0.1):
         console = self._console
@@ -159,45 +194,70 @@ class Agent():
         console.record = True
         
     def parse_reply(self, text):
-        lines = text.split('\n')
-        code_block = []
-        in_code_block = False
-        in_run_block = False
-        start = 0
-        end = 0
-        for i, line in enumerate(lines):
-            if line.strip().startswith('```run'): 
-                in_code_block = True
-                in_run_block = True
-                start = i
-                continue
-            elif line.strip().lower().startswith('```python'):
-                in_code_block = True
-                start = i
-                continue
-            elif line.strip().startswith('```') and in_run_block:
-                end = i
-                break
-            if in_code_block and line.find('#RUN') >= 0:
-                in_run_block = True
-
-        if end > 0:
-            code_block = lines[start+1:end]
-            ret = {'type': MsgType.CODE, 'code': '\n'.join(code_block)}
+        code = FenceDetector.parse(text)
+        if code is not None:
+            ret = {'type': MsgType.CODE, 'code': code}
         else:
             ret = {'type': MsgType.TEXT, 'code': None}
         return ret
         
+    def get_reply(self, response):
+        """ 优先执行 LLM 回复里的工具调用，没有工具调用时从回复文本里解析代码块 """
+        messages = self.llm.history.messages
+        last = messages[-1] if messages else None
+        if last and last.role == 'assistant' and last.tool_call:
+            return {'type': MsgType.CODE, 'code': last.tool_call['code']}
+        return self.parse_reply(response or '')
+
+    def log_messages(self):
+        """ 把新增的对话消息追加到事件日志 """
+        messages = self.llm.history.messages
+        if self.tasklog:
+            for i in range(self._logged, len(messages)):
+                self.tasklog.write('message', index=i, message=messages[i].__dict__)
+        self._logged = len(messages)
+
+    def add_usage(self, usage):
+        """ 没有对应消息的用量(如推测执行没有被选中的分支)计入任务的用量，并追加到事件日志 """
+        if not usage:
+            return
+        self.llm.history.add_usage(usage)
+        if self.tasklog:
+            self.tasklog.write('usage', usage=dict(usage))
+
+    def log_exec(self):
+        if self.tasklog:
+            index = len(self.runner.history) - 1
+            self.tasklog.write('exec', index=index, reply=len(self.llm.history.messages) - 1, record=self.runner.history[index])
+
     def process_code_reply(self, msg, llm=None):
         code_block = msg['code']
         self.box(f"\n⚡ {T('start_execute')}:", code_block, lang='python')
         result = self.runner(code_block)
+        self.log_exec()
+        return self.feedback(result, llm)
+
+    def format_feedback(self, result):
+        """ 精简模式下不重复任务指令(对话历史里已经有了)，JSON 不缩进，和上一轮相同的结果省略 """
+        result = filter_stats(result, self._stats_time)
+        if not self._compact:
+            result = json.dumps(result, ensure_ascii=False, indent=4)
+            return f"# 最初任务\n{self.instruction}\n\n# 代码执行结果反馈\n{result}"
+        data = compact_result(result, self._last_result)
+        self._last_result = result.get('__result__')
+        data = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        return f"# 代码执行结果反馈\n{data}"
+
+    def feedback(self, result, llm=None):
+        route = 'repair' if result.get('errstr') or result.get('traceback') else 'summary'
+        feed_back = self.format_feedback(result)
+        size = T('feedback_size', len(feed_back.encode('utf-8')), estimate_tokens(feed_back))
         result = json.dumps(result, ensure_ascii=False, indent=4)
-        self.box(f"\n✅ {T('execute_result')}:\n", result, lang="json")
+        self.box(f"\n✅ {T('execute_result')} ({size}):\n", result, lang="json")
         status = self._console.status(f"[dim white]{T('start_feedback')}...")
         self._console.print(status)
-        feed_back = f"# 最初任务\n{self.instruction}\n\n# 代码执行结果反馈\n{result}"
-        feedback_response = self.llm(feed_back, name=llm)
+        feedback_response = self.llm(feed_back, name=llm, kind='feedback', route=route, limit=self.get_input_limit())
+        self.log_messages()
         return feedback_response
 
     def box(self, title, content, align=None, lang=None):
@@ -233,9 +293,23 @@ class Agent():
         """
         summary = history.get_summary()
         if 'time' in summary:
+            hits = summary.get('cache_hits', 0)
+            lookups = hits + summary.get('cache_misses', 0)
+            cached = summary.get('cached_input_tokens', 0)
+            tool_calls = summary.get('tool_calls', 0)
             summary = "| {rounds} | {time:.3f}s | Tokens: {input_tokens}/{output_tokens}/{total_tokens}".format(**summary)
+            if lookups:
+                summary += f" | Cache: {hits}/{lookups}"
+            if cached:
+                summary += f" | Cached: {cached}"
+            if tool_calls:
+                summary += f" | Tools: {tool_calls}"
         else:
             summary = ''
+        stats = self.runner.get_summary()
+        if stats['blocks']:
+            summary += " | Exec: {blocks} | {wall_time:.3f}s | CPU: {cpu_time:.3f}s | RSS: +{rss:.1f}MB | Disk: +{disk:.1f}KB | Procs: {child_processes}".format(
+                rss=stats['peak_rss_delta'] / 1024 / 1024, disk=stats['bytes_written'] / 1024, **stats)
         self._console.print(f"\n⏹ [cyan]{T('end_instruction')} {summary}")
     
     def __call__(self, instruction, llm=None):
@@ -247,18 +321,121 @@ class Agent():
         if system_prompt:
             self.task_id = uuid.uuid4().hex
             self.instruction = instruction
+            self._last_result = None
             path = self._cwd / self.task_id
             path.mkdir(parents=True, exist_ok=False)
             os.chdir(path)
-        response = self.llm(instruction, system_prompt=system_prompt, name=llm)
-        while response:
-            msg = self.parse_reply(response)
-            if msg['type'] != MsgType.CODE:
+            self.tasklog = TaskLog(path)
+            self.tasklog.write('task', task_id=self.task_id, instruction=instruction, env=self.runner.env)
+            self.limit.start()
+        elif not self.check_limit():
+            self.print_summary()
+            return
+        if system_prompt and self.speculator and not llm:
+            response, llm = self.speculate(instruction, system_prompt)
+        else:
+            response = self.llm(instruction, system_prompt=system_prompt, name=llm, limit=self.get_input_limit())
+        self.log_messages()
+        self.run_loop(response, llm)
+
+    def speculate(self, instruction, system_prompt):
+        """ 任务指令同时发给多个 LLM，从第一个代码执行成功的分支继续，返回 (response, 分支的 LLM 名称) """
+        branch, usage = self.speculator(self.llm, self.runner, instruction, system_prompt)
+        if not branch:
+            self.add_usage(usage)
+            return self.llm(instruction, system_prompt=system_prompt, limit=self.get_input_limit()), None
+
+        self.llm.adopt(branch.history, branch.name)
+        self.add_usage(usage)
+        branch.show(self._console)
+        self.log_messages()
+        if branch.code is None:
+            return branch.msg.content, branch.name
+
+        self.runner.stop()
+        self.runner = branch.runner.adopt()
+        self.box(f"\n⚡ {T('start_execute')}:", branch.code, lang='python')
+        self.log_exec()
+        return self.feedback(branch.result, branch.name), branch.name
+
+    def get_input_limit(self):
+        return self.limit.get_input_limit(self.llm.history.get_summary())
+
+    def check_limit(self):
+        """ 下一轮会超出任务的用量上限时显示原因并返回 False """
+        reason = self.limit.check(self.llm.history.get_summary())
+        if reason:
+            self._console.print(f"\n⚠️ [yellow]{T('task_limit_reached')}: {reason}")
+        return reason is None
+
+    def run_loop(self, response, llm=None):
+        # 只有工具调用的回复内容为空字符串，请求失败时为 None
+        while response is not None:
+            msg = self.get_reply(response)
+            if msg['type'] != MsgType.CODE or not self.check_limit():
                 break
             response = self.process_code_reply(msg, llm)
         self.print_summary()
         os.write(1, b'\a\a\a')
 
+    def resume(self, task_id):
+        """ 从任务目录的事件日志恢复 ChatHistory、Runner.history 和 __session__，然后继续执行
+
+        - 最后一条是没有回复的用户消息：重新发送
+        - 最后一条 LLM 回复里的代码还没有执行：执行并反馈
+        已经完成的 LLM 轮次不会重新请求
+        """
+        path = self._cwd / task_id
+        task = TaskLog.load(path)
+        self.llm.clear()
+        self.runner.clear()
+        os.chdir(path)
+        self.task_id = task_id
+        self.instruction = task['instruction']
+        self._last_result = None
+
+        for name, (value, desc) in task['env'].items():
+            self.runner.setenv(name, value, desc)
+        session = {}
+        for record in task['runner'][1:]:
+            self.runner.history.append(record)
+            for name, (value, desc) in record.get('env', {}).items():
+                self.runner.setenv(name, value, desc)
+            # 只记录了摘要的大值无法恢复
+            session.update({key: value for key, value in record.get('session', {}).items() if not is_summary(value)})
+        self.runner.restore_session(session)
+
+        messages = task['llm']
+        pending = messages.pop() if messages and messages[-1]['role'] == 'user' else None
+        if not pending and not any(msg['role'] == 'user' for msg in messages):
+            # 任务指令还没有发送
+            pending = {'content': self.instruction}
+        history = self.llm.history
+        if self.system_prompt and not (messages and messages[0]['role'] == 'system'):
+            self.llm.current.add_system_prompt(history, self.system_prompt)
+        for msg in messages:
+            msg = ChatMessage(**msg)
+            msg.usage = Counter(msg.usage)
+            history.add_message(msg)
+        history.add_usage(task['usage'])
+        self._logged = len(history.messages)
+        self.tasklog = TaskLog(path)
+        self.tasklog.write('resume', task_id=task_id)
+        # 轮数和 tokens 从恢复的对话历史累计，时间从恢复时重新计算
+        self.limit.start()
+        self._console.print(f"[cyan]{T('task_resumed', task_id, history.get_summary()['rounds'], len(task['runner']) - 1)}")
+
+        last = len(messages) - 1
+        if pending:
+            response = self.llm(pending['content'], kind=pending.get('kind'), limit=self.get_input_limit())
+            self.log_messages()
+        elif last in task['executed']:
+            # 代码已经执行，但是结果还没有反馈给 LLM
+            response = self.feedback(task['runner'][task['executed'][last]]['result'])
+        else:
+            response = messages[last]['content'] if messages and messages[last]['role'] == 'assistant' else None
+        self.run_loop(response)
+
     def chat(self, prompt):
         system_prompt = None if self.llm.history else self.system_prompt
         response, ok = self.llm(prompt, system_prompt=system_prompt)
@@ -280,14 +457,17 @@ class Agent():
         title = title or self.instruction
         author = author or os.getlogin()
         meta = {'author': author}
-        files = {'content': self._console.export_html(clear=False)}
         data = {'title': title, 'metadata': json.dumps(meta)}
 
         if not (self.CERT_PATH.exists() and self.CERT_PATH.stat().st_size  > 0):
             self.CERT_PATH.write_text(cert)
 
         try:
-            response = requests.post(url, files=files, data=data, cert=str(self.CERT_PATH), verify=True)
+            import requests
+            self.save('console.html')
+            with open('console.html', 'rb') as f:
+                files = {'content': ('content', f)}
+                response = requests.post(url, files=files, data=data, cert=str(self.CERT_PATH), verify=True)
         except Exception as e:
             self._console.print_exception(e)
             return
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import asyncio
+import inspect
+import itertools
+
+from .i18n import T
+from .llm import (
+    LLM, BaseClient,
+    OpenAIClient, OllamaClient, ClaudeClient,
+    GeminiClient, DeepSeekClient, GrokClient, TrustClient
+)
+
+async def aclose_response(response):
+    close = getattr(response, 'aclose', None) or getattr(response, 'close', None)
+    if close:
+        try:
+            ret = close()
+            if inspect.isawaitable(ret):
+                await ret
+        except Exception:
+            pass
+
+class AsyncBaseClient(BaseClient):
+    """ 异步客户端基类
+
+    与同步客户端共用配置、请求参数、usage 和回复片段的解析(add_chunk)，只有网络请求和读取片段是异步的。
+    多个请求可以同时进行，所以流式回复不使用 Live 显示，结束后一次性输出。
+    """
+    def aiter_stream(self, response):
+        return response
+
+    async def _parse_stream_response(self, response):
+        stream = self.start_stream(live=False)
+        try:
+            with stream.renderer:
+                async for chunk in self.aiter_stream(response):
+                    if self.add_chunk(stream, chunk):
+                        break
+        finally:
+            await aclose_response(response)
+        return self.end_stream(stream)
+
+    async def parse_response(self, response):
+        if self._stream:
+            response = await self._parse_stream_response(response)
+        else:
+            response = self._parse_response(response)
+        self.limiter.consume(response.usage.get('output_tokens', 0))
+        self.calibrate(response.usage)
+        return response
+
+    async def on_async_response(self, response):
+        self.on_response(response)
+
+    async def get_completion(self, messages):
+        tokens = self.start_request(messages)
+        messages = self.format_messages(messages)
+        for attempt in itertools.count():
+            delay = self.limiter.reserve(tokens)
+            if delay:
+                await asyncio.sleep(delay)
+            try:
+                return await self._get_completion(messages)
+            except Exception as e:
+                delay = self.get_retry_delay(e, attempt)
+                if delay is None:
+                    self.console.print(f"❌ [bold red]{self.name} API {T('call_failed')}: [yellow]{str(e)}")
+                    return None
+                self.console.print(f"[yellow]{T('api_retry', self.name, str(e), round(delay, 1))}")
+                await asyncio.sleep(delay)
+
+    async def aclose(self):
+        pass
+
+    async def __call__(self, history, prompt, system_prompt=None, kind=None, limit=0):
+        if not history and system_prompt:
+            self.add_system_prompt(history, system_prompt)
+        history.add("user", prompt, kind=kind)
+
+        messages = self.prepare_messages(history, limit)
+        if messages is None:
+            return None
+        msg = self.get_cached(messages, live=False)
+        if msg:
+            history.add_message(msg)
+            return msg.content
+
+        start = time.time()
+        response = await self.get_completion(messages)
+        end = time.time()
+        if response:
+            msg = await self.parse_response(response)
+            msg.usage['time'] = round(end - start, 3)
+            self.put_cached(messages, msg)
+            history.add_message(msg)
+            response = msg.content
+        return response
+
+class AsyncOpenAIClient(AsyncBaseClient, OpenAIClient):
+    def __init__(self, config):
+        BaseClient.__init__(self, config)
+        import openai
+        http_client = openai.DefaultAsyncHttpxClient(event_hooks={'response': [self.on_async_response]})
+        self._client = openai.AsyncClient(api_key=self._api_key, base_url=self._base_url, timeout=self._timeout,
+                                          max_retries=0, http_client=http_client)
+
+    async def aclose(self):
+        await self._client.close()
+
+    async def _get_completion(self, messages):
+        return await self._client.chat.completions.create(**self.get_request(messages))
+
+class AsyncOllamaClient(AsyncBaseClient, OllamaClient):
+    def __init__(self, config):
+        BaseClient.__init__(self, config)
+        self._keep_alive = config.get("keep_alive")
+        self._num_ctx = config.get("num_ctx")
+        import httpx
+        pool_size = config.get("pool_size", self.POOL_SIZE)
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self._session = httpx.AsyncClient(timeout=self._timeout, limits=limits,
+                                          event_hooks={'response': [self.on_async_response]})
+
+    async def aclose(self):
+        await self._session.aclose()
+
+    def aiter_stream(self, response):
+        return response.aiter_lines()
+
+    async def _get_completion(self, messages):
+        request = self._session.build_request(
+            "POST",
+            f"{self._base_url}/api/chat",
+            json=self.get_payload(messages)
+        )
+        response = await self._session.send(request, stream=self._stream)
+        if response.is_error:
+            await response.aclose()
+        response.raise_for_status()
+        return response
+
+class AsyncClaudeClient(AsyncBaseClient, ClaudeClient):
+    def __init__(self, config):
+        BaseClient.__init__(self, config)
+        import anthropic
+        http_client = anthropic.DefaultAsyncHttpxClient(event_hooks={'response': [self.on_async_response]})
+        self._client = anthropic.AsyncAnthropic(api_key=self._api_key, base_url=self._base_url, timeout=self._timeout,
+                                                max_retries=0, http_client=http_client)
+        self._system_prompt = None
+
+    async def aclose(self):
+        await self._client.close()
+
+    async def _get_completion(self, messages):
+        return await self._client.messages.create(**self.get_request(messages))
+
+class AsyncGeminiClient(AsyncOpenAIClient):
+    BASE_URL = GeminiClient.BASE_URL
+    MODEL = GeminiClient.MODEL
+    FAMILY = GeminiClient.FAMILY
+
+class AsyncDeepSeekClient(AsyncOpenAIClient):
+    BASE_URL = DeepSeekClient.BASE_URL
+    MODEL = DeepSeekClient.MODEL
+    FAMILY = DeepSeekClient.FAMILY
+
+class AsyncGrokClient(AsyncOpenAIClient):
+    BASE_URL = GrokClient.BASE_URL
+    MODEL = GrokClient.MODEL
+
+class AsyncTrustClient(AsyncOpenAIClient):
+    BASE_URL = TrustClient.BASE_URL
+    MODEL = TrustClient.MODEL
+
+class AsyncLLM(LLM):
+    """ LLM 的异步版本
+
+    每个请求可以传入自己的 ChatHistory，这样一个事件循环里可以同时进行多个会话：
+        await asyncio.gather(llm(task1, history=h1), llm(task2, history=h2))
+    """
+    CLIENTS = {
+        "openai": AsyncOpenAIClient,
+        "ollama": AsyncOllamaClient,
+        "claude": AsyncClaudeClient,
+        "gemini": AsyncGeminiClient,
+        "deepseek": AsyncDeepSeekClient,
+        'grok': AsyncGrokClient,
+        'trust': AsyncTrustClient
+    }
+
+    async def aclose(self):
+        for client in self.llms.values():
+            await client.aclose()
+
+    async def __call__(self, instruction, system_prompt=None, name=None, history=None, kind=None):
+        llm = self.select(name)
+        history = self.history if history is None else history
+        return await llm(history, instruction, system_prompt=system_prompt, kind=kind)
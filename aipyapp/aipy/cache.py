@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+    key TEXT PRIMARY KEY,
+    role TEXT,
+    content TEXT,
+    reason TEXT,
+    usage TEXT,
+    size INTEGER,
+    created REAL,
+    accessed REAL
+);
+CREATE INDEX IF NOT EXISTS completions_accessed ON completions(accessed);
+"""
+
+class CompletionCache:
+    """ LLM 回复的本地缓存
+
+    - 以 provider、model、max_tokens 和消息列表的哈希作为键
+    - 保存在 SQLite 文件里，总大小超过 max_size 时按最近访问时间淘汰
+    - 超过 ttl 秒的记录视为过期，ttl 为 0 表示不过期
+    """
+    MAX_SIZE = 100      # MB
+    TTL = 7 * 24 * 3600
+    PATH = '~/.cache/aipyapp/completions.db'
+
+    def __init__(self, path=None, max_size=None, ttl=None):
+        path = Path(path or self.PATH).expanduser().resolve()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_size = int((max_size or self.MAX_SIZE) * 1024 * 1024)
+        self.ttl = self.TTL if ttl is None else ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    @classmethod
+    def from_config(cls, config):
+        if not config or not config.get('enable', False):
+            return None
+        return cls(config.get('path'), config.get('max_size'), config.get('ttl'))
+
+    def __repr__(self):
+        return f"<CompletionCache {self.path} hits={self.hits}, misses={self.misses}>"
+
+    @staticmethod
+    def make_key(provider, model, max_tokens, messages):
+        data = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+        digest = hashlib.sha256(data.encode('utf-8')).hexdigest()
+        return f"{provider}:{model}:{max_tokens}:{digest}"
+
+    def _expired(self, created, now):
+        return self.ttl and created + self.ttl < now
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT role, content, reason, usage, created FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row and self._expired(row[4], now):
+                self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._db.commit()
+                row = None
+            if not row:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE completions SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+        role, content, reason, usage, _ = row
+        return {'role': role, 'content': content, 'reason': reason, 'usage': json.loads(usage)}
+
+    def put(self, key, msg):
+        now = time.time()
+        usage = json.dumps(dict(msg.usage))
+        size = len(key) + len(msg.content.encode('utf-8')) + len((msg.reason or '').encode('utf-8')) + len(usage)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, msg.role, msg.content, msg.reason, usage, size, now, now)
+            )
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now):
+        if self.ttl:
+            self._db.execute("DELETE FROM completions WHERE created < ?", (now - self.ttl,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        if total <= self.max_size:
+            return
+        keys = []
+        for key, size in self._db.execute("SELECT key, size FROM completions ORDER BY accessed"):
+            keys.append((key,))
+            total -= size
+            if total <= self.max_size:
+                break
+        self._db.executemany("DELETE FROM completions WHERE key = ?", keys)
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM completions")
+            self._db.commit()
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+from time import monotonic
+
+class OutputCapture(io.TextIOBase):
+    """ 代替 StringIO 捕获代码块的 stdout/stderr，内存占用有上限
+
+    - 保留最开始的 head 个字符和最后的 tail 个字符，中间的部分丢弃，只累计丢弃的字节数
+    - stream 不为空时，新的输出按 interval 节流后交给 stream 实时显示，
+      每次最多显示最后的 live_max 个字符。节流只在写入时检查，没有新的输出就不会刷新
+    - write 只把字符串放进缓冲区，缓冲区满 CHUNK 个字符或到了显示时间才处理，
+      避免大量 print 时每次写入都执行截断逻辑
+    """
+    CHUNK = 65536
+    encoding = 'utf-8'
+
+    def __init__(self, head=8192, tail=8192, stream=None, interval=0.5, live_max=2000):
+        super().__init__()
+        self.head_size = head
+        self.tail_size = tail
+        self.head = ''
+        self.tail = ''
+        self.dropped = 0
+        self.buffer = []
+        self.buffer_len = 0
+        self.stream = stream
+        self.interval = interval
+        self.live_max = live_max
+        self.pending = ''
+        self.skipped = False
+        self.live = False
+        self.line_open = False
+        self.deadline = monotonic() + interval if stream else float('inf')
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        self.buffer.append(s)
+        self.buffer_len += len(s)
+        if self.buffer_len >= self.CHUNK or monotonic() >= self.deadline:
+            self.drain()
+        return len(s)
+
+    def drain(self):
+        text = ''.join(self.buffer)
+        self.buffer = []
+        self.buffer_len = 0
+        if self.stream:
+            self.pending += text
+            if len(self.pending) > self.live_max:
+                self.pending = self.pending[-self.live_max:]
+                self.skipped = True
+            now = monotonic()
+            if now >= self.deadline:
+                self.live = True
+                self.deadline = now + self.interval
+                self.show()
+
+        if len(self.head) < self.head_size:
+            part = text[:self.head_size - len(self.head)]
+            self.head += part
+            text = text[len(part):]
+        if text:
+            tail = self.tail + text
+            cut = len(tail) - self.tail_size
+            if cut > 0:
+                self.dropped += len(tail[:cut].encode('utf-8', 'replace'))
+                tail = tail[cut:]
+            self.tail = tail
+
+    def show(self, final=False):
+        text = self.pending
+        rest = ''
+        if not final:
+            # 未写完的行留到下次显示，除非一直没有换行
+            end = text.rfind('\n') + 1
+            if end:
+                text, rest = text[:end], text[end:]
+            elif len(text) < self.live_max:
+                return
+        if not text:
+            return
+        if self.skipped:
+            # 从完整的一行开始显示
+            text = text[text.find('\n') + 1:]
+            if self.line_open:
+                text = '\n' + text
+        self.pending = rest
+        self.skipped = False
+        if text:
+            self.line_open = not text.endswith('\n')
+            self.stream(text)
+
+    def close(self):
+        if not self.closed:
+            self.drain()
+            # 只有已经开始实时显示的代码块才补上剩余的输出，短代码块的输出在执行结果里显示
+            if self.live:
+                self.show(final=True)
+        super().close()
+
+    def getvalue(self):
+        if self.buffer:
+            self.drain()
+        if self.dropped:
+            return f"{self.head}\n...[{self.dropped} bytes dropped]...\n{self.tail}"
+        return self.head + self.tail
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+本地模拟 LLM 服务，用于离线、可重复的性能测试
+
+支持的协议（流式和非流式）：
+- OpenAI chat completions: POST /v1/chat/completions, /chat/completions
+- Ollama: POST /api/chat
+- Anthropic Messages: POST /v1/messages
+
+回复来自 Agent.done 保存的 task.json：按第一条用户消息匹配记录，
+按请求里的用户消息数选择记录里对应轮次的回复。
+
+用法:
+    python -m aipyapp.aipy.fakellm [task.json ...] [--port 8765] [--ttft 0.2] [--token-latency 0.01]
+"""
+
+import re
+import json
+import time
+import uuid
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from .fence import FenceDetector
+
+DEMO_TASK = {
+    'instruction': 'benchmark',
+    'llm': [
+        {'role': 'user', 'content': 'benchmark'},
+        {'role': 'assistant', 'content': (
+            "下面的代码计算斐波那契数列：\n\n"
+            "```python\n#RUN\n"
+            "def fib(n):\n    a, b = 0, 1\n    for _ in range(n):\n        a, b = b, a + b\n    return a\n\n"
+            "__result__ = {'fib': [fib(i) for i in range(20)]}\n"
+            "```\n\n"
+            "代码运行后，`__result__` 里会包含前 20 个斐波那契数。"
+            "斐波那契数列从 0 和 1 开始，之后的每一项都是前两项之和，"
+            "这里使用迭代而不是递归，时间复杂度为 O(n)，不会出现递归深度的问题。\n"
+        )},
+        {'role': 'user', 'content': 'feedback'},
+        {'role': 'assistant', 'content': "代码执行成功，前 20 个斐波那契数已经计算完成。"},
+    ]
+}
+
+TOKEN_RE = re.compile(r'\s*\S+|\s+')
+
+def tokenize(text):
+    return TOKEN_RE.findall(text)
+
+def estimate_tokens(data):
+    return max(1, len(json.dumps(data, ensure_ascii=False)) // 4)
+
+class Transcripts:
+    def __init__(self, tasks=None):
+        self.tasks = {}
+        for task in tasks or [DEMO_TASK]:
+            self.add(task)
+
+    @classmethod
+    def load(cls, paths):
+        tasks = []
+        for path in paths:
+            with open(path, encoding='utf-8') as f:
+                tasks.append(json.load(f))
+        return cls(tasks or None)
+
+    def add(self, task):
+        messages = [msg for msg in task['llm'] if msg['role'] != 'system']
+        users = [msg for msg in messages if msg['role'] == 'user']
+        replies = [msg['content'] for msg in messages if msg['role'] == 'assistant']
+        if users:
+            self.tasks[users[0]['content']] = replies
+
+    def reply(self, messages):
+        users = [msg for msg in messages if msg['role'] == 'user']
+        if not users:
+            return ''
+        replies = self.tasks.get(users[0]['content'])
+        if replies is None:
+            # 未录制的任务使用第一个记录
+            replies = next(iter(self.tasks.values()))
+        index = len(users) - 1
+        return replies[index] if index < len(replies) else replies[-1]
+
+def content_text(content):
+    if isinstance(content, list):
+        # tool_result 块的内容在 content 字段
+        return ''.join(part.get('text') or part.get('content') or '' for part in content if isinstance(part, dict))
+    return content or ''
+
+def split_tool_call(reply):
+    """ 请求里带有工具时，把回复里需要执行的代码块换成工具调用，返回 (代码块之前的文本, 工具参数) """
+    code = FenceDetector.parse(reply)
+    if code is None:
+        return reply, None
+    text = reply[:reply.find('```')].rstrip()
+    return text, json.dumps({'code': code}, ensure_ascii=False)
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        # OpenAI 的工具结果消息按用户消息计算轮次
+        messages = [{'role': 'user' if m['role'] == 'tool' else m['role'], 'content': content_text(m.get('content'))}
+                    for m in body.get('messages', [])]
+        reply = self.server.transcripts.reply(messages)
+        self.server.requests += 1
+
+        path = self.path.rstrip('/')
+        if path.endswith('/chat/completions'):
+            handler = self.openai
+        elif path.endswith('/api/chat'):
+            handler = self.ollama
+        elif path.endswith('/messages'):
+            handler = self.claude
+        else:
+            self.send_error(404)
+            return
+        try:
+            handler(body, messages, reply)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前结束了流式回复
+            self.close_connection = True
+
+    def send_json(self, data):
+        data = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def start_stream(self, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+    def write(self, data):
+        self.wfile.write(data.encode('utf-8'))
+        self.wfile.flush()
+
+    def tokens(self, reply):
+        """ 按配置的首字延迟和每 token 延迟产生回复片段 """
+        time.sleep(self.server.ttft)
+        for i, token in enumerate(tokenize(reply)):
+            if i:
+                time.sleep(self.server.token_latency)
+            yield token
+
+    def delay(self, reply):
+        time.sleep(self.server.ttft + self.server.token_latency * max(len(tokenize(reply)) - 1, 0))
+
+    def openai(self, body, messages, reply):
+        model = body.get('model', 'fake')
+        text, arguments = split_tool_call(reply) if body.get('tools') else (reply, None)
+        usage = {'prompt_tokens': estimate_tokens(messages), 'completion_tokens': len(tokenize(text)) + len(tokenize(arguments or ''))}
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        base = {'id': f"chatcmpl-{uuid.uuid4().hex}", 'created': int(time.time()), 'model': model}
+        call_id = f"call_{uuid.uuid4().hex[:24]}"
+        finish_reason = 'tool_calls' if arguments else 'stop'
+        if not body.get('stream'):
+            self.delay(reply)
+            message = {'role': 'assistant', 'content': text or None}
+            if arguments:
+                message['tool_calls'] = [{'id': call_id, 'type': 'function',
+                                          'function': {'name': 'execute_python', 'arguments': arguments}}]
+            self.send_json(dict(base, object='chat.completion', usage=usage,
+                                choices=[{'index': 0, 'message': message, 'finish_reason': finish_reason}]))
+            return
+
+        def event(choices, **kws):
+            self.write(f"data: {json.dumps(dict(base, object='chat.completion.chunk', choices=choices, **kws), ensure_ascii=False)}\n\n")
+
+        self.start_stream('text/event-stream')
+        for token in self.tokens(text):
+            event([{'index': 0, 'delta': {'role': 'assistant', 'content': token}, 'finish_reason': None}])
+        if arguments:
+            call = {'index': 0, 'id': call_id, 'type': 'function', 'function': {'name': 'execute_python', 'arguments': ''}}
+            event([{'index': 0, 'delta': {'tool_calls': [call]}, 'finish_reason': None}])
+            for token in self.tokens(arguments):
+                call = {'index': 0, 'function': {'arguments': token}}
+                event([{'index': 0, 'delta': {'tool_calls': [call]}, 'finish_reason': None}])
+        event([{'index': 0, 'delta': {}, 'finish_reason': finish_reason}])
+        if body.get('stream_options', {}).get('include_usage'):
+            event([], usage=usage)
+        self.write("data: [DONE]\n\n")
+
+    def ollama(self, body, messages, reply):
+        model = body.get('model', 'fake')
+        created = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        usage = {'prompt_eval_count': estimate_tokens(messages), 'eval_count': len(tokenize(reply))}
+        if not body.get('stream', True):
+            self.delay(reply)
+            message = {'role': 'assistant', 'content': reply}
+            self.send_json(dict(usage, model=model, created_at=created, message=message, done=True, done_reason='stop'))
+            return
+
+        self.start_stream('application/x-ndjson')
+        for token in self.tokens(reply):
+            line = {'model': model, 'created_at': created, 'message': {'role': 'assistant', 'content': token}, 'done': False}
+            self.write(json.dumps(line, ensure_ascii=False) + '\n')
+        line = dict(usage, model=model, created_at=created, message={'role': 'assistant', 'content': ''}, done=True, done_reason='stop')
+        self.write(json.dumps(line) + '\n')
+
+    def claude(self, body, messages, reply):
+        model = body.get('model', 'fake')
+        text, arguments = split_tool_call(reply) if body.get('tools') else (reply, None)
+        input_tokens = estimate_tokens([body.get('system')] + messages)
+        output_tokens = len(tokenize(text)) + len(tokenize(arguments or ''))
+        message = {'id': f"msg_{uuid.uuid4().hex}", 'type': 'message', 'role': 'assistant', 'model': model,
+                   'stop_reason': None, 'stop_sequence': None}
+        tool_id = f"toolu_{uuid.uuid4().hex[:24]}"
+        stop_reason = 'tool_use' if arguments else 'end_turn'
+        if not body.get('stream'):
+            self.delay(reply)
+            content = [{'type': 'text', 'text': text}] if text or not arguments else []
+            if arguments:
+                content.append({'type': 'tool_use', 'id': tool_id, 'name': 'execute_python', 'input': json.loads(arguments)})
+            self.send_json(dict(message, content=content, stop_reason=stop_reason,
+                                usage={'input_tokens': input_tokens, 'output_tokens': output_tokens}))
+            return
+
+        def event(name, **data):
+            self.write(f"event: {name}\ndata: {json.dumps(dict(type=name, **data), ensure_ascii=False)}\n\n")
+
+        self.start_stream('text/event-stream')
+        event('message_start', message=dict(message, content=[], usage={'input_tokens': input_tokens, 'output_tokens': 0}))
+        index = 0
+        if text or not arguments:
+            event('content_block_start', index=index, content_block={'type': 'text', 'text': ''})
+            for token in self.tokens(text):
+                event('content_block_delta', index=index, delta={'type': 'text_delta', 'text': token})
+            event('content_block_stop', index=index)
+            index += 1
+        if arguments:
+            event('content_block_start', index=index, content_block={'type': 'tool_use', 'id': tool_id, 'name': 'execute_python', 'input': {}})
+            for token in self.tokens(arguments):
+                event('content_block_delta', index=index, delta={'type': 'input_json_delta', 'partial_json': token})
+            event('content_block_stop', index=index)
+        event('message_delta', delta={'stop_reason': stop_reason, 'stop_sequence': None}, usage={'output_tokens': output_tokens})
+        event('message_stop')
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, transcripts=None, host='127.0.0.1', port=0, ttft=0, token_latency=0):
+        super().__init__((host, port), FakeLLMHandler)
+        self.transcripts = transcripts or Transcripts()
+        self.ttft = ttft
+        self.token_latency = token_latency
+        self.requests = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Fake OpenAI/Ollama/Anthropic server replaying task.json transcripts")
+    parser.add_argument('tasks', nargs='*', help="task.json files written by Agent.done")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--ttft', type=float, default=0, help="Time to first token (seconds)")
+    parser.add_argument('--token-latency', type=float, default=0, help="Latency per token (seconds)")
+    args = parser.parse_args()
+
+    server = FakeLLMServer(Transcripts.load(args.tasks), args.host, args.port, args.ttft, args.token_latency)
+    print(f"Fake LLM server listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+class FenceDetector:
+    """ 逐个片段识别回复里需要执行的代码块
+
+    规则和原来的 Agent.parse_reply 相同：
+    - ```run 或 ```python 开始一个代码块，块内出现 #RUN 的代码块需要执行
+    - 需要执行的代码块遇到 ``` 结束，之后的内容不再处理
+    只处理完整的行，未结束的行留到下一个片段，最后一行在 close 时处理。
+    """
+    def __init__(self):
+        self.code = None
+        self.end = None
+        self._line = []
+        self._lines = None
+        self._in_code = False
+        self._in_run = False
+        self._size = 0
+
+    @property
+    def done(self):
+        return self.code is not None
+
+    def feed(self, content):
+        """ 处理一个片段，找到代码块的结束标记时返回它所在行在片段里的结束位置，否则返回 None """
+        if self.done:
+            return None
+        start = 0
+        while True:
+            i = content.find('\n', start)
+            if i < 0:
+                break
+            self._line.append(content[start:i])
+            line = ''.join(self._line)
+            self._line = []
+            start = i + 1
+            if self._add_line(line):
+                self.end = self._size + i
+                self._size += len(content)
+                return i
+        if start < len(content):
+            self._line.append(content[start:])
+        self._size += len(content)
+        return None
+
+    def close(self):
+        """ 回复结束，处理最后一行 """
+        if self.done:
+            return
+        line = ''.join(self._line)
+        self._line = []
+        if self._add_line(line):
+            self.end = self._size
+
+    def _add_line(self, line):
+        stripped = line.strip()
+        if stripped.startswith('```run'):
+            self._in_code = True
+            self._in_run = True
+            self._lines = []
+            return False
+        if stripped.lower().startswith('```python'):
+            self._in_code = True
+            self._lines = []
+            return False
+        if stripped.startswith('```') and self._in_run:
+            self.code = '\n'.join(self._lines)
+            return True
+        if self._in_code and line.find('#RUN') >= 0:
+            self._in_run = True
+        if self._lines is not None:
+            self._lines.append(line)
+        return False
+
+    @classmethod
+    def parse(cls, text):
+        """ 返回完整回复里需要执行的代码，没有时返回 None """
+        detector = cls()
+        detector.feed(text)
+        detector.close()
+        return detector.code
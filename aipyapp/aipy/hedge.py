@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .i18n import T
+
+class CircuitBreaker:
+    """ 连续失败 max_failures 次的 LLM 暂停使用 cooldown 秒，之后允许再试一次 """
+    def __init__(self, max_failures=3, cooldown=60):
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self._failures = defaultdict(int)
+        self._opened = {}
+        self._lock = threading.Lock()
+
+    def available(self, name):
+        with self._lock:
+            opened = self._opened.get(name)
+            return opened is None or time.monotonic() - opened >= self.cooldown
+
+    def success(self, name):
+        with self._lock:
+            self._failures.pop(name, None)
+            self._opened.pop(name, None)
+
+    def failure(self, name):
+        with self._lock:
+            self._failures[name] += 1
+            if self._failures[name] >= self.max_failures:
+                self._opened[name] = time.monotonic()
+
+class LatencyTracker:
+    """ 记录每个 LLM 最近的首字延迟，对冲阈值取其百分位数 """
+    MAX_SAMPLES = 100
+    MIN_SAMPLES = 5
+
+    def __init__(self, percentile=95, delay=5):
+        self.percentile = percentile
+        self.delay = delay
+        self._samples = defaultdict(lambda: deque(maxlen=self.MAX_SAMPLES))
+        self._lock = threading.Lock()
+
+    def add(self, name, latency):
+        with self._lock:
+            self._samples[name].append(latency)
+
+    def get_delay(self, name):
+        with self._lock:
+            samples = sorted(self._samples[name])
+        if len(samples) < self.MIN_SAMPLES:
+            return self.delay
+        index = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return samples[index]
+
+def close_response(response):
+    close = getattr(response, 'close', None)
+    if close:
+        try:
+            close()
+        except Exception:
+            pass
+
+class Hedger:
+    """ 对冲请求和故障切换
+
+    - 主 LLM 在首字延迟阈值内没有返回第一个片段时，同时请求下一个备用 LLM，使用先返回的回复
+    - 请求失败时立即切换到下一个备用 LLM
+    - 落选的回复在返回后关闭，不再继续接收
+    """
+    def __init__(self, console, config):
+        self.console = console
+        self.backups = config.get('backups', [])
+        self.breaker = CircuitBreaker(config.get('max_failures', 3), config.get('cooldown', 60))
+        self.tracker = LatencyTracker(config.get('percentile', 95), config.get('delay', 5))
+
+    def get_candidates(self, primary, llm):
+        names = self.backups or list(llm.configs)
+        backups = [llm.get(name) for name in names if name in llm and name != primary.name]
+        candidates = [client for client in [primary] + backups if client and self.breaker.available(client.name)]
+        return candidates or [primary]
+
+    def open(self, client, messages):
+        """ 发送请求并等到第一个片段，失败返回 None """
+        start = time.monotonic()
+        response = client.get_completion(messages)
+        if not response:
+            return None
+        try:
+            response = client.peek(response)
+        except Exception as e:
+            self.console.print(f"❌ [bold red]{client.name} API {T('call_failed')}: [yellow]{str(e)}")
+            return None
+        self.tracker.add(client.name, time.monotonic() - start)
+        return response
+
+    def __call__(self, candidates, messages):
+        """ 返回 (client, response)，全部失败时 response 为 None """
+        candidates = list(candidates)
+        executor = ThreadPoolExecutor(max_workers=len(candidates))
+        futures = {}
+        winner = None
+
+        def submit():
+            client = candidates.pop(0)
+            future = executor.submit(self.open, client, messages)
+            futures[future] = client
+            return future
+
+        pending = {submit()}
+        primary = futures[next(iter(pending))]
+        delay = self.tracker.get_delay(primary.name)
+        try:
+            while pending and not winner:
+                done, pending = wait(pending, timeout=delay if candidates else None, return_when=FIRST_COMPLETED)
+                if not done:
+                    future = submit()
+                    pending.add(future)
+                    self.console.print(f"[dim]{T('hedge_request', primary.name, round(delay, 3), futures[future].name)}")
+                    continue
+
+                for future in done:
+                    client = futures[future]
+                    if future.exception() is None and future.result():
+                        self.breaker.success(client.name)
+                        winner = future
+                        break
+                    self.breaker.failure(client.name)
+                    if candidates and not pending:
+                        backup = submit()
+                        pending.add(backup)
+                        self.console.print(f"[yellow]{T('failover', client.name, futures[backup].name)}")
+        finally:
+            for future in futures:
+                if future is not winner:
+                    future.add_done_callback(lambda f: f.exception() is None and close_response(f.result()))
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        if not winner:
+            return primary, None
+        return futures[winner], winner.result()
@@ -8,6 +8,7 @@ MESSAGES = {
         'start_instruction': '开始处理指令',
         'start_execute': '开始执行代码块',
         'execute_result': '执行结果',
+        'feedback_size': '{} 字节，约 {} tokens',
         'start_feedback': '开始反馈结果',
         'end_instruction': '结束处理指令',
         'no_context': '未找到上下文信息',
@@ -61,12 +62,39 @@ MESSAGES = {
         'no_token_detected': "未检测到令牌输入。",
         'invalid_token': "输入的令牌不合法，请确保令牌正确，格式为‘sk-xxxxxx……’，或输入 'exit' 退出。",
         'token_saved': "令牌已保存到 {}",
-        'token_save_error': "保存令牌时出错: {}"
+        'token_save_error': "保存令牌时出错: {}",
+        'batch_start': "开始批量处理 {} 个任务，并发进程数 {}",
+        'batch_done': "批量处理结束，共 {} 个任务，失败 {} 个",
+        'cpu_timeout': "代码块超过了 CPU 时间限制",
+        'worker_timeout': "代码块执行超过 {} 秒，工作进程已终止，__session__ 已清空",
+        'worker_exited': "工作进程意外退出(退出码 {})，__session__ 已清空",
+        'worker_interrupted': "用户中断执行，工作进程已终止，__session__ 已清空",
+        'worker_start_failed': "代码执行工作进程启动失败",
+        'context_elided': "...[为控制上下文长度，省略了其余约 {} tokens]",
+        'hedge_request': "{} 在 {} 秒内没有响应，同时请求 {}",
+        'route_llm': "{} 轮次使用 {}",
+        'speculating': "同时请求 {}",
+        'branch_status': "{}: {}，{} 秒，{} tokens",
+        'branch_ok': "成功",
+        'branch_error': "执行出错",
+        'branch_cancelled': "已取消",
+        'speculate_winner': "使用 {} 的回复 ({} 秒)",
+        'context_compacted': "{} 请求约 {} tokens，超过上限 {}，上下文已缩减到约 {} tokens",
+        'input_too_long': "{} 请求缩减上下文后约 {} tokens，仍然超过上限 {}，没有发送",
+        'task_limit_reached': "任务达到用量上限，停止执行",
+        'limit_rounds': "已经进行了 {} 轮对话，上限 {} 轮",
+        'limit_time': "已经用时 {} 秒，下一轮预计超过上限 {} 秒",
+        'limit_tokens': "已经使用了 {} tokens，上限 {}",
+        'failover': "{} 调用失败，切换到 {}",
+        'api_retry': "{} API 调用失败: {}，{} 秒后重试",
+        'task_resumed': "已恢复任务 {}：{} 轮对话，{} 次代码执行",
+        'task_not_found': "找不到任务 {} 的事件日志"
     },
     'en': {
         'start_instruction': 'Start processing instruction',
         'start_execute': 'Start executing code block',
         'execute_result': 'Execution result',
+        'feedback_size': '{} bytes, ~{} tokens',
         'start_feedback': 'Start sending feedback',
         'end_instruction': 'End processing instruction',
         'no_context': 'No context information found',
@@ -120,7 +148,33 @@ MESSAGES = {
         'no_token_detected': "No token detected.",
         'invalid_token': "The entered token is invalid. Ensure it starts with 'sk-' followed by the correct characters, or type 'exit' to quit.",
         'token_saved': "Token saved to {}",
-        'token_save_error': "Error saving token: {}"
+        'token_save_error': "Error saving token: {}",
+        'batch_start': "Start batch processing of {} tasks with {} worker processes",
+        'batch_done': "Batch processing finished: {} tasks, {} failed",
+        'cpu_timeout': "Code block exceeded the CPU time limit",
+        'worker_timeout': "Code block ran longer than {} seconds, the worker was killed and __session__ was reset",
+        'worker_exited': "Worker process exited unexpectedly (exit code {}), __session__ was reset",
+        'worker_interrupted': "Execution interrupted by user, the worker was killed and __session__ was reset",
+        'worker_start_failed': "Failed to start the code execution worker process",
+        'context_elided': "...[about {} more tokens omitted to keep the context within budget]",
+        'hedge_request': "{} did not respond within {}s, also requesting {}",
+        'route_llm': "{} round uses {}",
+        'speculating': "Requesting {} concurrently",
+        'branch_status': "{}: {}, {}s, {} tokens",
+        'branch_ok': "succeeded",
+        'branch_error': "execution failed",
+        'branch_cancelled': "cancelled",
+        'speculate_winner': "Continuing with the reply from {} ({}s)",
+        'context_compacted': "{} request is about {} tokens, over the limit of {}, context compacted to about {} tokens",
+        'input_too_long': "{} request is still about {} tokens after compacting the context, over the limit of {}, not sent",
+        'task_limit_reached': "Task usage limit reached, stopping",
+        'limit_rounds': "{} rounds used, limit is {}",
+        'limit_time': "{}s elapsed, the next round would exceed the {}s limit",
+        'limit_tokens': "{} tokens used, limit is {}",
+        'failover': "{} failed, failing over to {}",
+        'api_retry': "{} API call failed: {}, retrying in {}s",
+        'task_resumed': "Resumed task {}: {} LLM rounds, {} code executions",
+        'task_not_found': "No event log found for task {}"
     }
 }
 
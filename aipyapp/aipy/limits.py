@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+from .i18n import T
+
+class TaskLimit:
+    """ 单个任务的用量上限，0 表示不限制
+
+    - max_rounds: LLM 回复的轮数
+    - max_time: 任务的墙钟时间(秒)，按已完成轮次的平均耗时预计下一轮会超出时停止
+    - max_tokens: 输入和输出 tokens 总数，下一轮请求可以使用剩余额度扣除平均输出 tokens 后的部分，
+      请求的输入 tokens 由 LLM 客户端在发送前本地估算，超出时先缩减上下文，仍然超出就不发送
+    """
+    def __init__(self, config=None):
+        config = config or {}
+        self.max_rounds = config.get('max_rounds', 0)
+        self.max_time = config.get('max_time', 0)
+        self.max_tokens = config.get('max_tokens', 0)
+        self.start_time = time.time()
+
+    def start(self):
+        self.start_time = time.time()
+
+    def get_reserve(self, summary):
+        """ 为下一轮回复预留的输出 tokens """
+        rounds = summary['rounds']
+        return summary['output_tokens'] // rounds if rounds else 0
+
+    def get_input_limit(self, summary):
+        """ 下一轮请求可以使用的输入 tokens，0 表示不限制 """
+        if not self.max_tokens:
+            return 0
+        return max(self.max_tokens - summary['total_tokens'] - self.get_reserve(summary), 1)
+
+    def check(self, summary):
+        """ 下一轮会超出上限时返回原因，否则返回 None """
+        rounds = summary['rounds']
+        if self.max_rounds and rounds >= self.max_rounds:
+            return T('limit_rounds', rounds, self.max_rounds)
+        elapsed = time.time() - self.start_time
+        if self.max_time and rounds and elapsed + elapsed / rounds > self.max_time:
+            return T('limit_time', round(elapsed, 1), self.max_time)
+        if self.max_tokens and summary['total_tokens'] + self.get_reserve(summary) >= self.max_tokens:
+            return T('limit_tokens', summary['total_tokens'], self.max_tokens)
+        return None
@@ -1,20 +1,55 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import json
 import time
+import hashlib
+import threading
+import itertools
+from types import SimpleNamespace
 from collections import Counter, defaultdict
 from dataclasses import dataclass, field
 from abc import ABC, abstractmethod
 
-import openai
-import requests
-import anthropic
-from rich.live import Live
-from rich.panel import Panel
-from rich.text import Text
-from rich.markdown import Markdown
-
 from .i18n import T
+from .hedge import Hedger, close_response
+from .router import Router
+from .fence import FenceDetector
+from .tokens import estimate_tokens, estimate_message_tokens, TokenEstimator
+from .ratelimit import RateLimiter, is_retryable, get_status, get_retry_after, backoff
+
+# 原生工具调用模式下提供给 LLM 的代码执行工具
+EXECUTE_PYTHON = 'execute_python'
+TOOL_DESCRIPTION = "在客户的 Python 运行环境里执行代码，执行结果在下一条消息里反馈。每次回复最多调用一次。"
+TOOL_PARAMETERS = {
+    'type': 'object',
+    'properties': {'code': {'type': 'string', 'description': '要执行的 Python 代码'}},
+    'required': ['code'],
+}
+
+def make_tool_call(id, name, arguments):
+    """ 解析工具调用，不是 execute_python 或参数无效时返回 None """
+    if name != EXECUTE_PYTHON:
+        return None
+    if isinstance(arguments, str):
+        try:
+            arguments = json.loads(arguments or '{}')
+        except json.JSONDecodeError:
+            return None
+    code = arguments.get('code') if isinstance(arguments, dict) else None
+    if not isinstance(code, str):
+        return None
+    return {'id': id, 'name': name, 'code': code}
+
+def to_fence(code):
+    return f"```python\n#RUN\n{code}\n```"
+
+def count_message_tokens(content, tool_call=None):
+    """ ChatHistory 使用的通用估算，工具调用的代码和消息内容一起发送，也要计算 """
+    tokens = estimate_message_tokens(content)
+    if tool_call:
+        tokens += estimate_tokens(tool_call['code'])
+    return tokens
 
 @dataclass
 class ChatMessage:
@@ -22,11 +57,34 @@ class ChatMessage:
     content: str
     reason: str = None
     usage: Counter = field(default_factory=Counter)
+    kind: str = None
+    tokens: int = 0
+    # LLM 回复里的工具调用: {'id', 'name', 'code'}
+    tool_call: dict = None
+    # 工具执行结果对应的工具调用 id
+    tool_call_id: str = None
+    # 回复这条消息的 LLM 名称和路由选择时的轮次类型
+    llm: str = None
+    route: str = None
 
 class ChatHistory:
-    def __init__(self):
+    """ 对话历史
+
+    budget 不为 0 时，get_messages 把发送给 LLM 的上下文控制在 budget tokens 以内：
+    - 系统提示词、第一条指令和最近 keep_rounds 轮对话原样保留
+    - 从最早的开始，把执行结果反馈(kind='feedback')缩减为开头的摘要
+    - 仍然超出时，再缩减较早的 LLM 回复
+    messages 本身不会修改，完整内容仍然保存在 task.json 里
+    """
+    KEEP_ROUNDS = 2
+    SUMMARY_CHARS = 200
+
+    def __init__(self, budget=0, keep_rounds=None):
         self.messages = []
+        self.budget = budget or 0
+        self.keep_rounds = self.KEEP_ROUNDS if keep_rounds is None else keep_rounds
         self._total_tokens = Counter()
+        self._context_tokens = 0
 
     def __len__(self):
         return len(self.messages)
@@ -34,12 +92,25 @@ class ChatHistory:
     def json(self):
         return [msg.__dict__ for msg in self.messages]
     
-    def add(self, role, content):
-        self.add_message(ChatMessage(role=role, content=content))
+    def add(self, role, content, kind=None):
+        self.add_message(ChatMessage(role=role, content=content, kind=kind))
 
     def add_message(self, message: ChatMessage):
+        # 工具调用之后的用户消息就是它的执行结果
+        if message.role == 'user' and not message.tool_call_id and self.messages and self.messages[-1].tool_call:
+            message.tool_call_id = self.messages[-1].tool_call['id']
+        message.tokens = count_message_tokens(message.content, message.tool_call)
         self.messages.append(message)
         self._total_tokens += message.usage
+        self._context_tokens += message.tokens
+
+    def add_usage(self, usage):
+        """ 计入没有对应消息的用量 """
+        self._total_tokens += Counter(usage)
+
+    @property
+    def context_tokens(self):
+        return self._context_tokens
 
     def get_usage(self):
         return iter(row.usage for row in self.messages if row.role == "assistant")
@@ -48,69 +119,368 @@ class ChatHistory:
         summary = {'time': 0, 'input_tokens': 0, 'output_tokens': 0, 'total_tokens': 0}
         summary.update(dict(self._total_tokens))
         summary['rounds'] = sum(1 for row in self.messages if row.role == "assistant")
+        summary['tool_calls'] = sum(1 for row in self.messages if row.tool_call)
         return summary
 
-    def get_messages(self):
-        return [{"role": msg.role, "content": msg.content} for msg in self.messages]
+    def summarize(self, text, prefix=''):
+        """ 缩减为开头的摘要，返回 (摘要, 节省的 tokens)，节省不了时返回原文 """
+        head = text[:self.SUMMARY_CHARS]
+        tokens = estimate_tokens(text)
+        summary = f"{head}\n{prefix}{T('context_elided', tokens - estimate_tokens(head))}"
+        saved = tokens - estimate_tokens(summary)
+        return (summary, saved) if saved > 0 else (text, 0)
+
+    def compact(self, msg):
+        """ 缩减一条消息，返回 (content, tool_call, 节省的 tokens)
+
+        工具调用的代码和消息内容一起发送，所以也要缩减，节省的 tokens 只计算实际替换掉的部分
+        """
+        content, saved = self.summarize(msg.content)
+        tool_call = msg.tool_call
+        if tool_call:
+            code, code_saved = self.summarize(tool_call['code'], prefix='# ')
+            if code_saved:
+                tool_call = dict(tool_call, code=code)
+                saved += code_saved
+        return content, tool_call, saved
+
+    def get_context(self, budget=None):
+        """ 返回在 budget 以内的 (消息内容, 工具调用) 列表，budget 参数和 self.budget 都不为 0 时取较小的 """
+        context = [(msg.content, msg.tool_call) for msg in self.messages]
+        total = self._context_tokens
+        budget = min([n for n in (self.budget, budget) if n] or [0])
+        if not budget or total <= budget:
+            return context
+
+        first_user = next((i for i, msg in enumerate(self.messages) if msg.role == 'user'), None)
+        end = len(self.messages) - self.keep_rounds * 2
+        candidates = [i for i in range(end) if i != first_user and self.messages[i].role != 'system']
+        feedback = [i for i in candidates if self.messages[i].kind == 'feedback']
+        others = [i for i in candidates if self.messages[i].kind != 'feedback']
+        for i in feedback + others:
+            if total <= budget:
+                break
+            content, tool_call, saved = self.compact(self.messages[i])
+            if saved > 0:
+                context[i] = (content, tool_call)
+                total -= saved
+        return context
+
+    def get_messages(self, budget=None):
+        """ 工具调用和工具结果以 tool_call/tool_call_id 字段保存，由各个客户端转换为自己的格式 """
+        messages = []
+        for msg, (content, tool_call) in zip(self.messages, self.get_context(budget)):
+            message = {"role": msg.role, "content": content}
+            if tool_call:
+                message['tool_call'] = tool_call
+            if msg.tool_call_id:
+                message['tool_call_id'] = msg.tool_call_id
+            messages.append(message)
+        return messages
+
+class PeekedStream:
+    """ 已经读取了第一个片段的流式回复，可以继续迭代，也可以关闭底层的连接 """
+    def __init__(self, first, chunks, response):
+        self._chunks = itertools.chain([first], chunks)
+        self._response = response
+
+    def __iter__(self):
+        return self._chunks
+
+    def close(self):
+        close_response(self._response)
 
 class BaseClient(ABC):
     MODEL = None
     BASE_URL = None
+    # 本地估算 tokens 使用的分词器家族，见 TokenEstimator.FAMILIES
+    FAMILY = 'openai'
+    REPLAY_CHUNK_SIZE = 16
+    MAX_RETRIES = 3
+    # 是否支持原生工具调用
+    TOOLS = False
 
     def __init__(self, config):
         self.name = None
         self.console = None
+        self.cache = None
         self.max_tokens = config.get("max_tokens")
         self._model = config.get("model") or self.MODEL
         self._timeout = config.get("timeout")
         self._api_key = config.get("api_key")
         self._base_url = config.get("base_url") or self.BASE_URL
         self._stream = config.get("stream", True)
+        self._prompt_cache = config.get("prompt_cache", True)
+        self._stop_at_fence = config.get("stop_at_fence", True)
+        self._tools = self.TOOLS and config.get("tools", False)
+        # 最近一次请求的估算输入 tokens，校准后的值和校准前的值
+        self._input_tokens = 0
+        self._raw_input_tokens = 0
+        # 上下文窗口(输入和输出 tokens 之和)，0 表示不检查
+        self._context_window = config.get("context_window", 0)
+        self.estimator = TokenEstimator(self.FAMILY)
+        self._max_retries = config.get("max_retries", self.MAX_RETRIES)
+        self.limiter = RateLimiter(config.get("rpm", 0), config.get("tpm", 0))
 
     def __repr__(self):
         return f"{self.__class__.__name__}<{self.name}>({self._model}, {self.max_tokens})"
     
     @abstractmethod
-    def get_completion(self, messages):
+    def _get_completion(self, messages):
+        """ 发送请求，出错时抛出异常 """
         pass
+
+    def on_response(self, response, *args, **kwargs):
+        """ HTTP 响应钩子：根据速率限制响应头更新限流状态 """
+        self.limiter.update(response.headers)
+
+    def count_tokens(self, messages):
+        """ 未校准的估算值 """
+        return self.estimator.raw_messages(messages)
+
+    def estimate_tokens(self, messages):
+        return self.estimator.scale(self.count_tokens(messages))
+
+    def start_request(self, messages):
+        """ 记录请求的估算输入 tokens：校准前的值用于校准，校准后的值用于限流和补全缺少的用量 """
+        self._raw_input_tokens = self.count_tokens(messages)
+        self._input_tokens = self.estimator.scale(self._raw_input_tokens)
+        return self._input_tokens
+
+    def get_input_limit(self):
+        """ 上下文窗口扣除输出 tokens 后留给输入的部分，0 表示不限制 """
+        if not self._context_window:
+            return 0
+        return max(self._context_window - (self.max_tokens or 0), 1)
+
+    def prepare_messages(self, history, limit=0):
+        """ 发送前在本地估算请求的输入 tokens
+
+        上限取上下文窗口留给输入的部分和 limit(任务剩余的 tokens)中较小的。
+        超过上限时缩减较早的上下文，仍然超过时不发送，返回 None，避免上传之后才收到上下文超长的错误
+        """
+        messages = history.get_messages()
+        limits = [n for n in (self.get_input_limit(), limit) if n > 0]
+        if not limits:
+            return messages
+        limit = min(limits)
+        tokens = self.estimate_tokens(messages)
+        if tokens <= limit:
+            return messages
+
+        # ChatHistory 的 budget 按通用的估算方法计算，这里按比例换算。
+        # 不在对话历史里的部分(如 Claude 单独保存的系统提示词)不会缩减，按比例换算的 budget 可能不够，
+        # 所以按仍然超出的比例继续缩小 budget，直到不超过上限或者不能再缩减
+        generic = sum(count_message_tokens(msg['content'], msg.get('tool_call')) for msg in messages)
+        budget = max(1, limit * generic // tokens)
+        compacted = tokens
+        while True:
+            messages = history.get_messages(budget)
+            previous, compacted = compacted, self.estimate_tokens(messages)
+            if compacted <= limit:
+                self.console.print(f"[dim]{T('context_compacted', self.name, tokens, limit, compacted)}")
+                return messages
+            if compacted >= previous or budget == 1:
+                break
+            budget = max(1, budget * limit // compacted)
+        self.console.print(f"❌ [bold red]{T('input_too_long', self.name, compacted, limit)}")
+        return None
+
+    def calibrate(self, usage):
+        """ 用实际的输入 tokens 校准本地估算，提前结束的 OpenAI 流式回复没有实际用量 """
+        if 'early_stops' not in usage:
+            self.estimator.calibrate(self._raw_input_tokens, usage.get('input_tokens', 0))
+
+    def get_retry_delay(self, e, attempt):
+        """ 返回重试前等待的秒数，不能重试时返回 None """
+        if attempt >= self._max_retries or not is_retryable(e):
+            return None
+        delay = get_retry_after(e)
+        if delay is None:
+            delay = backoff(attempt)
+        if get_status(e) == 429:
+            self.limiter.block(delay)
+        return delay
+
+    def get_completion(self, messages):
+        """ 按速率限制排队发送请求，速率限制、服务端错误和网络错误按指数退避重试 """
+        tokens = self.start_request(messages)
+        messages = self.format_messages(messages)
+        for attempt in itertools.count():
+            delay = self.limiter.reserve(tokens)
+            if delay:
+                time.sleep(delay)
+            try:
+                return self._get_completion(messages)
+            except Exception as e:
+                delay = self.get_retry_delay(e, attempt)
+                if delay is None:
+                    self.console.print(f"❌ [bold red]{self.name} API {T('call_failed')}: [yellow]{str(e)}")
+                    return None
+                self.console.print(f"[yellow]{T('api_retry', self.name, str(e), round(delay, 1))}")
+                time.sleep(delay)
         
     def add_system_prompt(self, history, system_prompt):
         history.add("system", system_prompt)
 
+    def format_messages(self, messages):
+        """ 不使用工具调用时，把对话历史里的工具调用还原为代码块，工具结果作为普通的用户消息 """
+        if not any('tool_call' in msg or 'tool_call_id' in msg for msg in messages):
+            return messages
+        ret = []
+        for msg in messages:
+            content = msg['content']
+            if msg.get('tool_call'):
+                content = f"{content}\n\n{to_fence(msg['tool_call']['code'])}".lstrip()
+            ret.append({'role': msg['role'], 'content': content})
+        return ret
+
     @abstractmethod
     def _parse_usage(self, response):
         pass
 
     @abstractmethod
-    def _parse_stream_response(self, response):
+    def add_chunk(self, stream, chunk):
+        """ 处理流式回复的一个片段，不再需要接收剩余部分时返回 True """
         pass
 
     @abstractmethod
     def _parse_response(self, response):
         pass
 
+    def peek(self, response):
+        """ 读取流式回复的第一个片段，返回的回复仍然可以完整解析 """
+        if not self._stream:
+            return response
+        chunks = iter(response)
+        first = next(chunks)
+        return PeekedStream(first, chunks, response)
+
+    def make_renderer(self, live=True):
+        """ stop_at_fence 为 True 时，需要执行的代码块结束后不再接收回复的剩余部分 """
+        # render 导入 rich 的 Live/Markdown，第一次显示回复时才导入
+        from .render import StreamRenderer
+        detector = FenceDetector() if self._stop_at_fence else None
+        return StreamRenderer(self.console, self.name, live=live, detector=detector)
+
+    def estimate_usage(self, usage, text):
+        """ 提前结束的流式回复收不到最后的用量统计，缺少的部分用估算值代替 """
+        if not usage.get('input_tokens'):
+            usage['input_tokens'] = self._input_tokens
+        if not usage.get('output_tokens'):
+            usage['output_tokens'] = self.estimator.count(text)
+        usage['total_tokens'] = usage['input_tokens'] + usage['output_tokens']
+        usage['early_stops'] = 1
+        return usage
+
+    def start_stream(self, live=True):
+        """ 开始解析流式回复，返回保存解析状态的对象
+
+        同步和异步客户端共用 add_chunk/end_stream，只有读取片段和关闭连接的方式不同
+        """
+        return SimpleNamespace(renderer=self.make_renderer(live), usage=Counter(), calls={})
+
+    def iter_stream(self, response):
+        return response
+
+    def feed_text(self, stream, text):
+        """ 显示回复文本，需要执行的代码块已经结束时估算用量并返回 True """
+        stream.renderer.feed(text)
+        if stream.renderer.stopped:
+            stream.usage = self.estimate_usage(stream.usage, stream.renderer.text)
+            return True
+        return False
+
+    def end_stream(self, stream):
+        return ChatMessage(role="assistant", content=stream.renderer.text, usage=self._finish_usage(stream.usage),
+                           tool_call=self._get_tool_call(stream.calls))
+
+    def _finish_usage(self, usage):
+        return usage
+
+    def _get_tool_call(self, calls):
+        """ 只执行第一个工具调用 """
+        if not calls:
+            return None
+        call = calls[min(calls)]
+        return make_tool_call(call['id'], call['name'], ''.join(call['arguments']))
+
+    def _parse_stream_response(self, response):
+        stream = self.start_stream()
+        try:
+            with stream.renderer:
+                for chunk in self.iter_stream(response):
+                    if self.add_chunk(stream, chunk):
+                        break
+        finally:
+            close_response(response)
+        return self.end_stream(stream)
+
     def parse_response(self, response):
         if self._stream:
             response = self._parse_stream_response(response)
         else:
             response = self._parse_response(response)
+        self.limiter.consume(response.usage.get('output_tokens', 0))
+        self.calibrate(response.usage)
         return response
+
+    def get_cache_key(self, messages):
+        # cache 导入 sqlite3，只在启用缓存时导入
+        from .cache import CompletionCache
+        provider = self._base_url or self.__class__.__name__
+        return CompletionCache.make_key(provider, self._model, self.max_tokens, messages)
+
+    def get_cached(self, messages, live=True):
+        """ 命中缓存时，按流式回复的方式重放保存的回复 """
+        if not self.cache:
+            return None
+        cached = self.cache.get(self.get_cache_key(messages))
+        if not cached:
+            return None
+
+        start = time.time()
+        content = cached['content']
+        if self._stream:
+            from .render import StreamRenderer
+            with StreamRenderer(self.console, self.name, live=live) as renderer:
+                for i in range(0, len(content), self.REPLAY_CHUNK_SIZE):
+                    renderer.feed(content[i:i+self.REPLAY_CHUNK_SIZE])
+        usage = Counter({'cache_hits': 1, 'time': round(time.time() - start, 3)})
+        return ChatMessage(role=cached['role'], content=content, reason=cached['reason'], usage=usage)
+
+    def put_cached(self, messages, msg):
+        if not self.cache:
+            return
+        msg.usage['cache_misses'] = 1
+        # 缓存只保存文本回复，工具调用不缓存
+        if msg.content and not msg.tool_call:
+            self.cache.put(self.get_cache_key(messages), msg)
     
-    def __call__(self, history, prompt, system_prompt=None):
+    def __call__(self, history, prompt, system_prompt=None, kind=None, limit=0):
         # We shall only send system prompt once
         if not history and system_prompt:
             self.add_system_prompt(history, system_prompt)
-        history.add("user", prompt)
+        history.add("user", prompt, kind=kind)
+
+        messages = self.prepare_messages(history, limit)
+        if messages is None:
+            return None
+        msg = self.get_cached(messages)
+        if msg:
+            history.add_message(msg)
+            return msg.content
 
         start = time.time()
         self.console.record = False
         with self.console.status(f"[dim white]{T('sending_task', self.name)} ..."):
-            response = self.get_completion(history.get_messages())
+            response = self.get_completion(messages)
         self.console.record = True
         end = time.time()
         if response:
             msg = self.parse_response(response)
             msg.usage['time'] = round(end - start, 3)
+            self.put_cached(messages, msg)
             history.add_message(msg)
             response = msg.content
         return response
@@ -118,217 +488,358 @@ class BaseClient(ABC):
 # https://platform.openai.com/docs/api-reference/chat/create
 # https://api-docs.deepseek.com/api/create-chat-completion
 class OpenAIClient(BaseClient):
+    TOOLS = True
+
     def __init__(self, config):
         super().__init__(config)
-        self._client = openai.Client(api_key=self._api_key, base_url=self._base_url, timeout=self._timeout)
+        import openai
+        http_client = openai.DefaultHttpxClient(event_hooks={'response': [self.on_response]})
+        self._client = openai.Client(api_key=self._api_key, base_url=self._base_url, timeout=self._timeout,
+                                     max_retries=0, http_client=http_client)
 
     def add_system_prompt(self, history, system_prompt):
         history.add("system", system_prompt)
 
     def _parse_usage(self, usage):
-        usage = Counter({'total_tokens': usage.total_tokens,
+        ret = Counter({'total_tokens': usage.total_tokens,
                 'input_tokens': usage.prompt_tokens,
                 'output_tokens': usage.completion_tokens})
-        return usage
+        # OpenAI/Grok: prompt_tokens_details.cached_tokens, DeepSeek: prompt_cache_hit_tokens
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached = getattr(details, 'cached_tokens', None)
+        if cached is None:
+            cached = getattr(usage, 'prompt_cache_hit_tokens', None)
+        if cached is not None:
+            ret['cached_input_tokens'] = cached
+            ret['uncached_input_tokens'] = usage.prompt_tokens - cached
+        return ret
+
+    def get_completion_kws(self, messages):
+        kws = {}
+        if self._tools:
+            kws['tools'] = [{'type': 'function', 'function': {
+                'name': EXECUTE_PYTHON, 'description': TOOL_DESCRIPTION, 'parameters': TOOL_PARAMETERS}}]
+        if self._base_url:
+            return kws
+        if self._stream:
+            kws['stream_options'] = {'include_usage': True}
+        # 相同系统提示词的请求使用相同的 prompt_cache_key，提高 OpenAI 前缀缓存命中率
+        if self._prompt_cache and messages and messages[0]['role'] == 'system':
+            key = hashlib.sha256(messages[0]['content'].encode('utf-8')).hexdigest()[:32]
+            kws['extra_body'] = {'prompt_cache_key': key}
+        return kws
     
-    def _parse_stream_response(self, response):
-        full_response = ""
-        
-        title = f"{self.name} {T('llm_response')}"
-        usage = Counter()
-        with Live(auto_refresh=True, vertical_overflow='visible') as live:
-            status = self.console.status(f"[dim white]{self.name} {T('thinking')}...", spinner='runner')
-            response_panel = Panel(status, title=title, border_style="blue")
-            live.update(response_panel)
-            
-            for chunk in response:
-                if hasattr(chunk, 'usage') and chunk.usage is not None:
-                    usage = self._parse_usage(chunk.usage)
-
-                if chunk.choices and chunk.choices[0].delta.content:
-                    content = chunk.choices[0].delta.content
-                    full_response += content
-                    
-                    try:
-                        md = Markdown(full_response)
-                        response_panel = Panel(md, title=title, border_style="green")
-                    except Exception:
-                        text = Text(full_response)
-                        response_panel = Panel(text, title=title, border_style="yellow")
-                    
-                    live.update(response_panel)
-                    
-        segments = self.console.render(response_panel)
-        self.console._record_buffer.extend(segments)
-        return ChatMessage(role="assistant", content=full_response, usage=usage)
+    def format_messages(self, messages):
+        if not self._tools:
+            return super().format_messages(messages)
+        ret = []
+        for msg in messages:
+            if msg.get('tool_call'):
+                call = msg['tool_call']
+                function = {'name': call['name'], 'arguments': json.dumps({'code': call['code']}, ensure_ascii=False)}
+                ret.append({'role': 'assistant', 'content': msg['content'] or None,
+                            'tool_calls': [{'id': call['id'], 'type': 'function', 'function': function}]})
+            elif msg.get('tool_call_id'):
+                ret.append({'role': 'tool', 'tool_call_id': msg['tool_call_id'], 'content': msg['content']})
+            else:
+                ret.append({'role': msg['role'], 'content': msg['content']})
+        return ret
+
+    def _add_tool_deltas(self, calls, deltas):
+        """ 按 index 拼接流式回复里的工具调用片段 """
+        for delta in deltas:
+            call = calls.setdefault(delta.index or 0, {'id': None, 'name': None, 'arguments': []})
+            if delta.id:
+                call['id'] = delta.id
+            function = delta.function
+            if function and function.name:
+                call['name'] = function.name
+            if function and function.arguments:
+                call['arguments'].append(function.arguments)
+
+    def add_chunk(self, stream, chunk):
+        if getattr(chunk, 'usage', None) is not None:
+            stream.usage = self._parse_usage(chunk.usage)
+        if not chunk.choices:
+            return False
+        delta = chunk.choices[0].delta
+        if getattr(delta, 'tool_calls', None):
+            self._add_tool_deltas(stream.calls, delta.tool_calls)
+        return bool(delta.content) and self.feed_text(stream, delta.content)
 
     def _parse_response(self, response):
         message = response.choices[0].message
         reason = getattr(message, "reasoning_content", None)
+        tool_call = None
+        if getattr(message, 'tool_calls', None):
+            call = message.tool_calls[0]
+            tool_call = make_tool_call(call.id, call.function.name, call.function.arguments)
         return ChatMessage(
             role=message.role,
-            content=message.content,
+            content=message.content or '',
             reason=reason,
-            usage=self._parse_usage(response.usage)
+            usage=self._parse_usage(response.usage),
+            tool_call=tool_call
         )
 
-    def get_completion(self, messages):
-        kws = {'stream_options': {'include_usage': True}} if self._stream and not self._base_url else {}
-        try:
-            response = self._client.chat.completions.create(
-                model = self._model,
-                messages = messages,
-                stream=self._stream,
-                max_tokens = self.max_tokens,
-                **kws
-            )
-        except Exception as e:
-            self.console.print(f"❌ [bold red]{self.name} API {T('call_failed')}: [yellow]{str(e)}")
-            response = None
-        return response
+    def get_request(self, messages):
+        """ chat.completions.create 的参数，同步和异步客户端共用 """
+        return dict(
+            model = self._model,
+            messages = messages,
+            stream=self._stream,
+            max_tokens = self.max_tokens,
+            **self.get_completion_kws(messages)
+        )
+
+    def _get_completion(self, messages):
+        return self._client.chat.completions.create(**self.get_request(messages))
 
 # https://github.com/ollama/ollama/blob/main/docs/api.md
 class OllamaClient(BaseClient):
+    POOL_SIZE = 10
+    FAMILY = 'ollama'
+
     def __init__(self, config):
         super().__init__(config)
+        self._keep_alive = config.get("keep_alive")
+        self._num_ctx = config.get("num_ctx")
+        pool_size = config.get("pool_size", self.POOL_SIZE)
+        import requests
         self._session = requests.Session()
+        self._session.hooks['response'].append(self.on_response)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        if config.get("preload"):
+            threading.Thread(target=self.preload, daemon=True).start()
+
+    def get_payload(self, messages, stream=None):
+        options = {"num_predict": self.max_tokens}
+        if self._num_ctx:
+            options["num_ctx"] = self._num_ctx
+        payload = {
+            "model": self._model,
+            "messages": messages,
+            "stream": self._stream if stream is None else stream,
+            "options": options
+        }
+        if self._keep_alive is not None:
+            payload["keep_alive"] = self._keep_alive
+        return payload
+
+    def preload(self):
+        """ 空消息的请求只加载模型，避免第一轮对话等待模型加载 """
+        try:
+            self._session.post(f"{self._base_url}/api/chat", json=self.get_payload([], stream=False), timeout=self._timeout)
+        except Exception:
+            pass
 
     def _parse_usage(self, response):
-        ret = {'input_tokens': response['prompt_eval_count'], 'output_tokens': response['eval_count']}
+        # 提示词命中 Ollama 缓存时可能没有 prompt_eval_count
+        ret = {'input_tokens': response.get('prompt_eval_count', 0), 'output_tokens': response.get('eval_count', 0)}
         ret['total_tokens'] = ret['input_tokens'] + ret['output_tokens']
         return ret
 
-    def _parse_stream_response(self, response):
-        full_response = ""
-        
-        title = f"{self.name} {T('llm_response')}"
-        with Live(auto_refresh=True, vertical_overflow='visible') as live:
-            status = self.console.status(f"[dim white]{self.name} {T('thinking')}...", spinner='runner')
-            response_panel = Panel(status, title=title, border_style="blue")
-            live.update(response_panel)
-            
-            for chunk in response:
-                msg = chunk.json()
-                if msg['done']:
-                    usage = self._parse_usage(chunk.usage)
-                    break
-
-                if 'message' in msg and 'content' in msg['message'] and msg['message']['content']:
-                    content = msg['message']['content']
-                    full_response += content
-                    
-                    try:
-                        md = Markdown(full_response)
-                        response_panel = Panel(md, title=title, border_style="green")
-                    except Exception:
-                        text = Text(full_response)
-                        response_panel = Panel(text, title=title, border_style="yellow")
-                    
-                    live.update(response_panel)
-                    
-        segments = self.console.render(response_panel)
-        self.console._record_buffer.extend(segments)
-        return ChatMessage(role="assistant", content=full_response, usage=usage)
+    def peek(self, response):
+        if not self._stream:
+            return response
+        lines = response.iter_lines()
+        first = next(lines)
+        return SimpleNamespace(iter_lines=lambda: itertools.chain([first], lines), close=response.close)
+
+    def iter_stream(self, response):
+        return response.iter_lines()
+
+    def add_chunk(self, stream, line):
+        if not line:
+            return False
+        msg = json.loads(line)
+        if msg['done']:
+            stream.usage = Counter(self._parse_usage(msg))
+            return True
+        content = msg.get('message', {}).get('content')
+        return bool(content) and self.feed_text(stream, content)
 
     def _parse_response(self, response):
         response = response.json()
         msg = response["message"]
         return ChatMessage(role=msg['role'], content=msg['content'], usage=self._parse_usage(response))
     
-    def get_completion(self, messages):
-        try:
-            response = self._session.post(
-                f"{self._base_url}/api/chat",
-                json={
-                    "model": self._model,
-                    "messages": messages,
-                    "stream": self._stream,
-                    "options": {"num_predict": self.max_tokens}
-                },
-                timeout=self._timeout
-            )
-            response.raise_for_status()
-        except Exception as e:
-            self.console.print(f"❌ [bold red]{self.name} API {T('call_failed')}: [yellow]{str(e)}")
-            response = None
+    def _get_completion(self, messages):
+        response = self._session.post(
+            f"{self._base_url}/api/chat",
+            json=self.get_payload(messages),
+            stream=self._stream,
+            timeout=self._timeout
+        )
+        response.raise_for_status()
         return response
 
 # https://docs.anthropic.com/en/api/messages
 class ClaudeClient(BaseClient):
+    TOOLS = True
+    FAMILY = 'claude'
+
     def __init__(self, config):
         super().__init__(config)
-        self._client = anthropic.Anthropic(api_key=self._api_key, timeout=self._timeout)
+        import anthropic
+        http_client = anthropic.DefaultHttpxClient(event_hooks={'response': [self.on_response]})
+        self._client = anthropic.Anthropic(api_key=self._api_key, base_url=self._base_url, timeout=self._timeout,
+                                           max_retries=0, http_client=http_client)
         self._system_prompt = None
 
+    def _add_usage(self, usage, data):
+        """ message_delta 里的用量是累计值，每一项保留最后一个不为 None 的值，不能相加 """
+        for key in ('input_tokens', 'output_tokens', 'cache_read_input_tokens', 'cache_creation_input_tokens'):
+            value = getattr(data, key, None)
+            if value is not None:
+                usage[key] = value
+
+    def _finish_usage(self, usage):
+        """ Claude 的 input_tokens 不包括缓存读写的部分，这里换算成总输入 tokens """
+        cached = usage.pop('cache_read_input_tokens', 0)
+        written = usage.pop('cache_creation_input_tokens', 0)
+        uncached = usage['input_tokens'] + written
+        usage['input_tokens'] = uncached + cached
+        usage['cached_input_tokens'] = cached
+        usage['uncached_input_tokens'] = uncached
+        usage['cache_write_tokens'] = written
+        usage['total_tokens'] = usage['input_tokens'] + usage['output_tokens']
+        return usage
+
+    def estimate_usage(self, usage, text):
+        """ 输入 tokens 在 message_start 里已经给出，只需要估算输出 tokens """
+        usage['output_tokens'] = max(usage['output_tokens'], self.estimator.count(text))
+        usage['early_stops'] = 1
+        return usage
+
     def _parse_usage(self, response):
-        usage = response.usage
-        ret = {'input_tokens': usage.input_tokens, 'output_tokens': usage.output_tokens}
-        ret['total_tokens'] = ret['input_tokens'] + ret['output_tokens']
-        return ret
+        usage = Counter()
+        self._add_usage(usage, response.usage)
+        return self._finish_usage(usage)
 
-    def _parse_stream_response(self, response):
-        usage = Counter()    
-        full_response = ""
-        
-        title = f"{self.name} {T('llm_response')}"
-        with Live(auto_refresh=True, vertical_overflow='visible') as live:
-            status = self.console.status(f"[dim white]{self.name} {T('thinking')}...", spinner='runner')
-            response_panel = Panel(status, title=title, border_style="blue")
-            live.update(response_panel)
-            
-            for event in response:
-                if hasattr(event, 'delta') and hasattr(event.delta, 'text') and event.delta.text:
-                    content = event.delta.text
-                    full_response += content
-                    
-                    try:
-                        md = Markdown(full_response)
-                        response_panel = Panel(md, title=title, border_style="green")
-                    except Exception:
-                        text = Text(full_response)
-                        response_panel = Panel(text, title=title, border_style="yellow")
-                    live.update(response_panel)
-                elif hasattr(event, 'message') and hasattr(event.message, 'usage') and event.message.usage:
-                    usage['input_tokens'] += getattr(event.message.usage, 'input_tokens', 0)
-                    usage['output_tokens'] += getattr(event.message.usage, 'output_tokens', 0)
-                elif hasattr(event, 'usage') and event.usage:
-                    usage['input_tokens'] += getattr(event.usage, 'input_tokens', 0)
-                    usage['output_tokens'] += getattr(event.usage, 'output_tokens', 0)
-
-        usage['total_tokens'] = usage['input_tokens'] + usage['output_tokens']          
-        segments = self.console.render(response_panel)
-        self.console._record_buffer.extend(segments)
-        return ChatMessage(role="assistant", content=full_response, usage=usage)
+    def _add_tool_event(self, calls, event):
+        """ 记录 tool_use 块的开始和参数片段，不是工具调用的事件返回 False """
+        block = getattr(event, 'content_block', None)
+        if block is not None and block.type == 'tool_use':
+            calls[event.index] = {'id': block.id, 'name': block.name, 'arguments': []}
+            return True
+        partial = getattr(getattr(event, 'delta', None), 'partial_json', None)
+        if partial is not None and event.index in calls:
+            calls[event.index]['arguments'].append(partial)
+            return True
+        return False
+
+    def add_chunk(self, stream, event):
+        text = getattr(getattr(event, 'delta', None), 'text', None)
+        if text:
+            return self.feed_text(stream, text)
+        if self._add_tool_event(stream.calls, event):
+            return False
+        message = getattr(event, 'message', None)
+        if getattr(message, 'usage', None):
+            self._add_usage(stream.usage, message.usage)
+        elif getattr(event, 'usage', None):
+            self._add_usage(stream.usage, event.usage)
+        return False
 
     def _parse_response(self, response):
-        content = response.content[0].text
+        content = ''.join(block.text for block in response.content if block.type == 'text')
+        tool_call = None
+        for block in response.content:
+            if block.type == 'tool_use':
+                tool_call = make_tool_call(block.id, block.name, block.input)
+                break
         role = response.role
-        return ChatMessage(role=role, content=content, usage=self._parse_usage(response))
+        return ChatMessage(role=role, content=content, usage=self._parse_usage(response), tool_call=tool_call)
     
     def add_system_prompt(self, history, system_prompt):
         self._system_prompt = system_prompt
 
-    def get_completion(self, messages):
-        try:
-            message = self._client.messages.create(
-                model = self._model,
-                messages = messages,
-                stream=self._stream,
-                system=self._system_prompt,
-                max_tokens = self.max_tokens
-            )
-        except Exception as e:
-            self.console.print(f"❌ [bold red]{self.name} API {T('call_failed')}: [yellow]{str(e)}")
-            message = None
-        return message
+    def count_tokens(self, messages):
+        """ 系统提示词可能不在消息列表里，也要计算 """
+        system_prompt, messages = self.split_system(messages)
+        return super().count_tokens([{"role": "system", "content": system_prompt}] + messages)
+
+    def split_system(self, messages):
+        """ 对冲请求时系统提示词保存在对话历史里，Claude 需要单独传递 """
+        if messages and messages[0]['role'] == 'system':
+            return messages[0]['content'], messages[1:]
+        return self._system_prompt, messages
+
+    def get_cache_key(self, messages):
+        system_prompt, messages = self.split_system(messages)
+        messages = [{"role": "system", "content": system_prompt}] + messages
+        return super().get_cache_key(messages)
+
+    def get_system(self, system_prompt):
+        if not (self._prompt_cache and system_prompt):
+            return system_prompt
+        return [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+
+    def format_messages(self, messages):
+        if not self._tools:
+            return super().format_messages(messages)
+        ret = []
+        for msg in messages:
+            if msg.get('tool_call'):
+                call = msg['tool_call']
+                content = [{'type': 'text', 'text': msg['content']}] if msg['content'] else []
+                content.append({'type': 'tool_use', 'id': call['id'], 'name': call['name'], 'input': {'code': call['code']}})
+                ret.append({'role': 'assistant', 'content': content})
+            elif msg.get('tool_call_id'):
+                content = [{'type': 'tool_result', 'tool_use_id': msg['tool_call_id'], 'content': msg['content']}]
+                ret.append({'role': 'user', 'content': content})
+            else:
+                ret.append({'role': msg['role'], 'content': msg['content']})
+        return ret
+
+    def get_cached_messages(self, messages):
+        """ 在最后一条用户消息上设置缓存断点，下一轮请求可以复用到这里为止的前缀 """
+        if not self._prompt_cache:
+            return messages
+        messages = list(messages)
+        for i in range(len(messages) - 1, -1, -1):
+            if messages[i]['role'] == 'user':
+                content = messages[i]['content']
+                if isinstance(content, str):
+                    content = [{"type": "text", "text": content}]
+                content = content[:-1] + [dict(content[-1], cache_control={"type": "ephemeral"})]
+                messages[i] = {"role": "user", "content": content}
+                break
+        return messages
+
+    def get_completion_kws(self):
+        kws = {}
+        if self._tools:
+            kws['tools'] = [{'name': EXECUTE_PYTHON, 'description': TOOL_DESCRIPTION, 'input_schema': TOOL_PARAMETERS}]
+        return kws
+
+    def get_request(self, messages):
+        """ messages.create 的参数，同步和异步客户端共用 """
+        system_prompt, messages = self.split_system(messages)
+        return dict(
+            model = self._model,
+            messages = self.get_cached_messages(messages),
+            stream=self._stream,
+            system=self.get_system(system_prompt),
+            max_tokens = self.max_tokens,
+            **self.get_completion_kws()
+        )
+
+    def _get_completion(self, messages):
+        return self._client.messages.create(**self.get_request(messages))
 
 class GeminiClient(OpenAIClient): 
     BASE_URL = 'https://generativelanguage.googleapis.com/v1beta/'
     MODEL = 'gemini-2.5-pro-exp-03-25'
+    FAMILY = 'gemini'
 
 class DeepSeekClient(OpenAIClient): 
     BASE_URL = 'https://api.deepseek.com'
     MODEL = 'deepseek-chat'
+    FAMILY = 'deepseek'
 
 class GrokClient(OpenAIClient): 
     BASE_URL = 'https://api.x.ai/v1/'
@@ -349,12 +860,18 @@ class LLM(object):
         'trust': TrustClient
     }
 
-    def __init__(self, console, configs, max_tokens=None):
+    def __init__(self, console, configs, max_tokens=None, cache=None, context=None, hedge=None, route=None):
+        """ 客户端在第一次使用时才创建，SDK 也在那时才导入 """
         self.llms = {}
+        self.configs = {}
         self.console = console
-        self.default = None
+        self.cache = cache
+        self.context = context or {}
+        self.hedger = Hedger(console, hedge) if hedge and hedge.get('enable') else None
+        self.router = Router(route) if route and route.get('enable') else None
+        self._default = None
         self._last = None
-        self.history = ChatHistory()
+        self.history = self.new_history()
         self.max_tokens = max_tokens
         names = defaultdict(set)
         for name, config in configs.items():
@@ -362,37 +879,42 @@ class LLM(object):
                 names['disabled'].add(name)
                 continue
 
-            try:
-                client = self.get_client(config)
-            except Exception as e:
-                self.console.print_exception()
+            proto = config.get("type", "openai")
+            if proto.lower() not in self.CLIENTS:
+                self.console.print(f"❌ [bold red]Unsupported LLM provider: {proto}")
                 names['error'].add(name)
                 continue
-            
+
             names['available'].add(name)
-            client.name = name
-            client.console = console
-            if not client.max_tokens:
-                client.max_tokens = self.max_tokens
-            self.llms[name] = client
-
-            if config.get('default', False) and not self.default:
-                self.default = client
-                names['default'] = name
-
-        if not self.default:
-            name = list(self.llms.keys())[0]
-            self.default = self.llms[name]
-            names['default'] = name
-        self.current = self.default
+            self.configs[name] = config
+            if config.get('default', False) and not self._default:
+                self._default = name
+
+        if not self._default and self.configs:
+            self._default = next(iter(self.configs))
+        names['default'] = self._default
+        self._current = self._default
         self.names = names
 
+        # 需要预加载模型的客户端现在就创建
+        for name, config in self.configs.items():
+            if config.get('preload'):
+                self.get(name)
+
     def __len__(self):
-        return len(self.llms)
+        return len(self.configs)
     
     def __repr__(self):
-        return f"Current: {'default' if self.current == self.default else self.current}, Default: {self.default}"
+        return f"Current: {'default' if self._current == self._default else self.current}, Default: {self.default}"
     
+    @property
+    def default(self):
+        return self.get(self._default)
+
+    @property
+    def current(self):
+        return self.get(self._current)
+
     @property
     def last(self):
         return self._last.name if self._last else None
@@ -400,32 +922,54 @@ class LLM(object):
     def get_last_message(self, role='assistant'):
         return self.history.get_last_message(role)
     
+    def new_history(self):
+        return ChatHistory(self.context.get('budget', 0), self.context.get('keep_rounds'))
+
     def clear(self):
-        self.history = ChatHistory()
+        self.history = self.new_history()
+
+    def adopt(self, history, name):
+        """ 使用在别处完成的对话(推测执行选中的分支)继续任务 """
+        self.history = history
+        self._last = self.get(name)
 
     def get_client(self, config):
         proto = config.get("type", "openai")
-        model = config.get("model")
-        max_tokens = config.get("max_tokens") or self.max_tokens
-        timeout = config.get("timeout")
-
         client = self.CLIENTS.get(proto.lower())
         if not client:
             raise ValueError(f"Unsupported LLM provider: {proto}")
         return client(config)
+
+    def get(self, name):
+        """ 返回名称对应的客户端，第一次使用时创建 """
+        client = self.llms.get(name)
+        if client or name not in self.configs:
+            return client
+
+        try:
+            client = self.get_client(self.configs[name])
+        except Exception as e:
+            self.console.print_exception()
+            return None
+        client.name = name
+        client.console = self.console
+        client.cache = self.cache
+        if not client.max_tokens:
+            client.max_tokens = self.max_tokens
+        self.llms[name] = client
+        return client
     
     def __contains__(self, name):
-        return name in self.llms
+        return name in self.configs
     
     def use(self, name):
-        llm = self.llms.get(name)
-        if not llm:
+        if name not in self.configs:
             self.console.print(f"[red]LLM: {name} not found")
         else:
-            self.current = llm
+            self._current = name
             self.console.print(f"[green]LLM: use {name}")
 
-    def __call__(self, instruction, system_prompt=None, name=None):
+    def select(self, name=None):
         """ LLM 选择规则
         1. 如果 name 为 None, 使用 current
         2. 如果 name 存在，使用 name 对应的
@@ -434,7 +978,81 @@ class LLM(object):
         if not name:
             llm = self.current
         else:
-            llm = self.llms.get(name, self.default)
+            llm = self.get(name) if name in self.configs else self.default
         self._last = llm
-        return llm(self.history, instruction, system_prompt=system_prompt)
+        return llm
+
+    def hedged_call(self, primary, instruction, system_prompt=None, kind=None, limit=0):
+        """ 同一个请求可能由不同的 LLM 回复，所以系统提示词统一保存在对话历史里 """
+        history = self.history
+        if not history and system_prompt:
+            history.add("system", system_prompt)
+        history.add("user", instruction, kind=kind)
+
+        messages = primary.prepare_messages(history, limit)
+        if messages is None:
+            return None
+        msg = primary.get_cached(messages)
+        if msg:
+            history.add_message(msg)
+            return msg.content
+
+        start = time.time()
+        self.console.record = False
+        with self.console.status(f"[dim white]{T('sending_task', primary.name)} ..."):
+            client, response = self.hedger(self.hedger.get_candidates(primary, self), messages)
+        self.console.record = True
+        end = time.time()
+        if not response:
+            return None
+
+        self._last = client
+        msg = client.parse_response(response)
+        msg.usage['time'] = round(end - start, 3)
+        client.put_cached(messages, msg)
+        history.add_message(msg)
+        return msg.content
+
+    def select_route(self, route, system_prompt=None):
+        """ 按轮次类型选择 LLM，没有匹配的规则时返回 None(使用当前 LLM)
+
+        一个任务的不同轮次可能由不同的 LLM 回复，所以系统提示词统一保存在对话历史里
+        """
+        if not self.history and system_prompt:
+            self.history.add("system", system_prompt)
+        name = self.router.select(route, self.configs)
+        if name:
+            self.console.print(f"[dim]{T('route_llm', route, name)}")
+        return name
+
+    def __call__(self, instruction, system_prompt=None, name=None, kind=None, route=None, limit=0):
+        """ route 是轮次类型：plan(任务指令)、repair(执行出错后的反馈)、summary(执行成功后的反馈)，
+        只在启用了路由并且没有指定 name 时使用
+        limit 是这次请求允许的输入 tokens，0 表示只受上下文窗口限制
+        """
+        if self.router and not name:
+            route = route or ('summary' if kind == 'feedback' else 'plan')
+            name = self.select_route(route, system_prompt)
+        else:
+            route = None
+        llm = self.select(name)
+        if not llm:
+            return None
+
+        count = len(self.history)
+        start = time.time()
+        if self.hedger:
+            response = self.hedged_call(llm, instruction, system_prompt=system_prompt, kind=kind, limit=limit)
+        else:
+            response = llm(self.history, instruction, system_prompt=system_prompt, kind=kind, limit=limit)
+        latency = time.time() - start
+
+        msg = self.history.messages[-1] if len(self.history) > count else None
+        if msg and msg.role == 'assistant':
+            msg.llm = self._last.name
+            msg.route = route
+            latency = msg.usage.get('time', latency)
+        if self.router:
+            self.router.update(self._last.name, latency, response is not None)
+        return response
         
\ No newline at end of file
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# 会创建子进程的审计事件
+SPAWN_EVENTS = {'subprocess.Popen', 'os.system', 'os.fork', 'os.forkpty', 'os.spawn', 'os.startfile'}
+
+# 以写方式打开文件的标志
+WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_APPEND | os.O_CREAT | os.O_TRUNC
+
+_spawned = 0
+_hooked = False
+# 正在统计的代码块各自以写方式打开过的文件: {路径: 第一次打开前的大小}
+_opened = []
+
+def file_size(path):
+    try:
+        return os.stat(path).st_size
+    except (OSError, ValueError):
+        return 0
+
+def _audit_hook(event, args):
+    global _spawned
+    if event in SPAWN_EVENTS:
+        _spawned += 1
+    elif event == 'open' and _opened:
+        path, _, flags = args
+        if not (isinstance(flags, int) and flags & WRITE_FLAGS and isinstance(path, (str, bytes, os.PathLike))):
+            return
+        try:
+            path = os.path.abspath(os.fsdecode(path))
+        except (TypeError, ValueError):
+            return
+        for opened in _opened:
+            if path not in opened:
+                opened[path] = file_size(path)
+
+def install_hook():
+    global _hooked
+    if not _hooked:
+        sys.addaudithook(_audit_hook)
+        _hooked = True
+
+def peak_rss():
+    """ 本进程的内存峰值(字节)，不支持的平台返回 0 """
+    if not resource:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def cpu_time(times):
+    return times.user + times.system + times.children_user + times.children_system
+
+class ResourceMeter:
+    """ 统计一个代码块的资源使用：墙钟时间、CPU 时间(含子进程)、内存峰值增量、
+    任务目录写入的字节数和创建的子进程数
+
+    写入的字节数是代码块在 path(默认为当前目录)下以写方式打开的文件的大小增量，
+    由审计钩子记录打开的文件，不需要遍历目录，子进程写入的文件不计算在内
+    """
+    def __init__(self, path=None):
+        install_hook()
+        self.path = os.path.join(os.path.abspath(path or os.getcwd()), '')
+        self._opened = {}
+        _opened.append(self._opened)
+        self._rss = peak_rss()
+        self._spawned = _spawned
+        self._times = os.times()
+        self._start = time.perf_counter()
+
+    def get_bytes_written(self):
+        return sum(file_size(path) - size for path, size in self._opened.items() if path.startswith(self.path))
+
+    def stop(self):
+        wall_time = time.perf_counter() - self._start
+        times = os.times()
+        _opened.remove(self._opened)
+        return {
+            'wall_time': round(wall_time, 3),
+            'cpu_time': round(cpu_time(times) - cpu_time(self._times), 3),
+            'peak_rss_delta': peak_rss() - self._rss,
+            'bytes_written': self.get_bytes_written(),
+            'child_processes': _spawned - self._spawned,
+        }
+
+def summarize(history):
+    """ 汇总 Runner.history 里所有代码块的资源使用 """
+    summary = {'blocks': 0, 'wall_time': 0, 'cpu_time': 0, 'peak_rss_delta': 0, 'bytes_written': 0, 'child_processes': 0}
+    for row in history:
+        stats = row.get('result', {}).get('stats') if isinstance(row, dict) else None
+        if not stats:
+            continue
+        summary['blocks'] += 1
+        for key, value in stats.items():
+            if key in summary:
+                summary[key] += value
+    summary['wall_time'] = round(summary['wall_time'], 3)
+    summary['cpu_time'] = round(summary['cpu_time'], 3)
+    return summary
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+import time
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+# 可以重试的 HTTP 状态码：请求超时、冲突、速率限制和服务端错误
+RETRY_STATUS = {408, 409, 429}
+# 网络错误，按异常类名判断，不需要导入各个 SDK
+RETRY_ERRORS = {'APIConnectionError', 'APITimeoutError', 'ConnectionError', 'Timeout', 'TimeoutException', 'TransportError'}
+
+# 速率限制响应头
+# OpenAI: x-ratelimit-remaining-requests, x-ratelimit-reset-requests: 1s / 6m0s / 20ms
+# Anthropic: anthropic-ratelimit-requests-remaining, anthropic-ratelimit-requests-reset: RFC 3339 时间
+RATELIMIT_HEADERS = [
+    ('x-ratelimit-remaining-requests', 'x-ratelimit-reset-requests'),
+    ('x-ratelimit-remaining-tokens', 'x-ratelimit-reset-tokens'),
+    ('anthropic-ratelimit-requests-remaining', 'anthropic-ratelimit-requests-reset'),
+    ('anthropic-ratelimit-tokens-remaining', 'anthropic-ratelimit-tokens-reset'),
+]
+DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+def parse_reset(value):
+    """ 把重置时间解析为距现在的秒数，无法解析返回 None """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = DURATION_RE.findall(value)
+    if parts and ''.join(num + unit for num, unit in parts) == value:
+        return sum(float(num) * DURATION_UNITS[unit] for num, unit in parts)
+    try:
+        reset = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        try:
+            reset = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    if reset.tzinfo is None:
+        reset = reset.replace(tzinfo=timezone.utc)
+    return max(0.0, (reset - datetime.now(timezone.utc)).total_seconds())
+
+def get_retry_after(e):
+    response = getattr(e, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    ms = headers.get('retry-after-ms')
+    if ms:
+        try:
+            return float(ms) / 1000
+        except ValueError:
+            pass
+    return parse_reset(headers.get('retry-after'))
+
+def get_status(e):
+    status = getattr(e, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(e, 'response', None), 'status_code', None)
+    return status
+
+def is_retryable(e):
+    status = get_status(e)
+    if status:
+        return status in RETRY_STATUS or status >= 500
+    return any(cls.__name__ in RETRY_ERRORS for cls in type(e).__mro__)
+
+class TokenBucket:
+    """ 每分钟 per_minute 个令牌的令牌桶
+
+    reserve 直接扣除令牌，返回需要等待的秒数，令牌不足时余额为负，后面的请求依次排队
+    """
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        self.refill()
+        self.level -= min(amount, self.capacity)
+        return max(0.0, -self.level / self.rate)
+
+    def consume(self, amount):
+        self.refill()
+        self.level -= amount
+
+class RateLimiter:
+    """ 单个 LLM 的速率限制
+
+    - rpm/tpm 来自配置，0 表示不限制
+    - 响应头显示额度用完时，到重置时间之前的请求都要等待
+    - 429 错误的 Retry-After 同样暂停所有请求
+    """
+    def __init__(self, rpm=0, tpm=0):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.blocked_until = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=0):
+        """ 预约一个请求，返回需要等待的秒数 """
+        with self._lock:
+            delay = self.blocked_until - time.monotonic()
+            if self.requests:
+                delay = max(delay, self.requests.reserve(1))
+            if self.tokens and tokens:
+                delay = max(delay, self.tokens.reserve(tokens))
+        return max(0.0, delay)
+
+    def consume(self, tokens):
+        """ 回复的输出 tokens 在请求时无法预知，收到回复后补扣 """
+        if self.tokens and tokens:
+            with self._lock:
+                self.tokens.consume(tokens)
+
+    def block(self, seconds):
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def update(self, headers):
+        if not headers:
+            return
+        for remaining, reset in RATELIMIT_HEADERS:
+            value = headers.get(remaining)
+            if value is None or value.strip() != '0':
+                continue
+            seconds = parse_reset(headers.get(reset))
+            if seconds:
+                self.block(seconds)
+
+def backoff(attempt, base=1, limit=60):
+    """ 指数退避，带随机抖动 """
+    return random.uniform(0, min(limit, base * 2 ** attempt))
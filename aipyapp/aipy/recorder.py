@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+from html import escape
+
+from rich.segment import Segment
+from rich.terminal_theme import DEFAULT_TERMINAL_THEME
+
+CODE_MARK = '\0code\0'
+
+class ConsoleRecorder(list):
+    """ 替代 Console._record_buffer，录制的内容立即转换为 HTML 片段写入临时文件
+
+    Console 只调用 _record_buffer.extend，所以列表本身始终为空，内存占用不随会话增长。
+    样式编号在整个会话里保持一致，导出 HTML 时只需要在片段前后加上页面模板，不需要重新渲染。
+    """
+    def __init__(self, theme=None):
+        super().__init__()
+        self.theme = theme or DEFAULT_TERMINAL_THEME
+        self.styles = {}
+        self._file = tempfile.TemporaryFile('w+', encoding='utf-8')
+
+    @classmethod
+    def install(cls, console, theme=None):
+        """ 接管 console 的录制，已经录制的内容一并写入 """
+        if not console.record:
+            return None
+        recorder = cls(theme)
+        with console._record_buffer_lock:
+            recorder.extend(console._record_buffer)
+            console._record_buffer = recorder
+        return recorder
+
+    def extend(self, segments):
+        fragments = []
+        for text, style, _ in Segment.filter_control(Segment.simplify(segments)):
+            text = escape(text)
+            if style:
+                rule = style.get_html_style(self.theme)
+                number = self.styles.setdefault(rule, len(self.styles) + 1)
+                if style.link:
+                    text = f'<a class="r{number}" href="{style.link}">{text}</a>'
+                else:
+                    text = f'<span class="r{number}">{text}</span>'
+            fragments.append(text)
+        self._file.write(''.join(fragments))
+
+    def append(self, segment):
+        self.extend([segment])
+
+    def __delitem__(self, key):
+        # Console 导出时用 del _record_buffer[:] 清空
+        self.reset()
+
+    def clear(self):
+        self.reset()
+
+    @property
+    def stylesheet(self):
+        return "\n".join(f".r{number} {{{rule}}}" for rule, number in self.styles.items() if rule)
+
+    def save_html(self, path, code_format, clear=False):
+        """ 把录制的内容套上 code_format 模板写入 path """
+        page = code_format.format(
+            code=CODE_MARK,
+            stylesheet=self.stylesheet,
+            foreground=self.theme.foreground_color.hex,
+            background=self.theme.background_color.hex,
+        )
+        head, tail = page.split(CODE_MARK, 1)
+        self._file.flush()
+        self._file.seek(0)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(head)
+            shutil.copyfileobj(self._file, f)
+            f.write(tail)
+        self._file.seek(0, 2)
+        if clear:
+            self.reset()
+
+    def reset(self):
+        self._file.seek(0)
+        self._file.truncate()
+        self.styles.clear()
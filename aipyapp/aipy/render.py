@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+from rich.live import Live
+from rich.panel import Panel
+from rich.text import Text
+from rich.console import Group
+from rich.segment import Segments
+from rich.markdown import Markdown
+
+from .i18n import T
+
+def is_fence(line):
+    return line.lstrip().startswith('```')
+
+def is_closing_fence(line):
+    line = line.strip()
+    return line.startswith('```') and not line.strip('`')
+
+class StreamRenderer:
+    """ 增量渲染 LLM 的流式回复
+
+    - 收到的片段保存在列表里，结束时才拼接成完整回复
+    - 已经结束的 Markdown 块（空行分隔的段落、闭合的代码块）只渲染一次
+    - 每帧只重新解析末尾未结束的块，并且按固定帧率刷新 Live
+    - live=False 时不使用 Live，结束后直接输出完整回复，可用于多个并发的流
+    - 设置了 detector 时，需要执行的代码块结束后 stopped 为 True，之后的片段丢弃
+    """
+    FPS = 8
+
+    def __init__(self, console, name, fps=None, live=True, detector=None):
+        self.console = console
+        self.name = name
+        self.live = live
+        self.title = f"{name} {T('llm_response')}"
+        self.fps = fps or self.FPS
+        self.panel = None
+        self._live = None
+        self._record = False
+        self._chunks = []
+        self._text = None
+        self._done = []
+        self._block = []
+        self._line = []
+        self._in_fence = False
+        self._blank = False
+        self._last_update = 0
+        self.detector = detector
+        self.stopped = False
+
+    def __enter__(self):
+        if not self.live:
+            return self
+        # Live 刷新的每一帧都会被录制，显示期间暂停录制，结束时只录制最终的面板
+        self._record = self.console.record
+        self.console.record = False
+        self._live = Live(console=self.console, auto_refresh=True, refresh_per_second=self.fps, vertical_overflow='visible')
+        self._live.__enter__()
+        status = self.console.status(f"[dim white]{self.name} {T('thinking')}...", spinner='runner')
+        self._live.update(Panel(status, title=self.title, border_style="blue"))
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.panel = self._make_panel(self.text)
+        if not self._live:
+            self.console.print(self.panel)
+            return False
+        try:
+            self._live.update(self.panel, refresh=True)
+            self._live.__exit__(exc_type, exc_value, tb)
+        finally:
+            self._live = None
+            self.console.record = self._record
+        if self._record:
+            segments = self.console.render(self.panel)
+            with self.console._record_buffer_lock:
+                self.console._record_buffer.extend(segments)
+        return False
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = ''.join(self._chunks)
+        return self._text
+
+    def feed(self, content):
+        if not content or self.stopped:
+            return
+        if self.detector:
+            end = self.detector.feed(content)
+            if end is not None:
+                content = content[:end]
+                self.stopped = True
+        self._chunks.append(content)
+        self._text = None
+        if not self.live:
+            return
+
+        lines = content.split('\n')
+        for part in lines[:-1]:
+            self._line.append(part)
+            self._add_line(''.join(self._line))
+            self._line = []
+        if lines[-1]:
+            self._line.append(lines[-1])
+
+        now = time.monotonic()
+        if now - self._last_update >= 1 / self.fps:
+            self._last_update = now
+            self._live.update(self._renderable())
+
+    def _add_line(self, line):
+        if self._in_fence:
+            self._block.append(line)
+            if is_closing_fence(line):
+                self._in_fence = False
+                self._commit()
+            return
+
+        if is_fence(line):
+            self._commit()
+            self._in_fence = True
+            self._block.append(line)
+            return
+
+        # 空行后出现顶格的新行，说明上一个块已经结束
+        if self._blank and line.strip() and not line[0].isspace():
+            self._commit()
+        self._blank = not line.strip()
+        self._block.append(line)
+
+    def _commit(self):
+        text = '\n'.join(self._block)
+        self._block = []
+        self._blank = False
+        if not text.strip():
+            return
+
+        options = self.console.options.update_width(max(self.console.width - 4, 1))
+        segments = list(self.console.render(Markdown(text), options))
+        # 列表、代码块等自带前导空行，段落之间需要补一个空行
+        if self._done and segments and segments[0].text.strip():
+            self._done.extend(self.console.render(Text(), options))
+        self._done.extend(segments)
+
+    def _make_panel(self, text):
+        try:
+            return Panel(Markdown(text), title=self.title, border_style="green")
+        except Exception:
+            return Panel(Text(text), title=self.title, border_style="yellow")
+
+    def _renderable(self):
+        tail = '\n'.join(self._block + [''.join(self._line)])
+        if not self._done:
+            return self._make_panel(tail)
+
+        parts = [Segments(self._done)]
+        if tail.strip():
+            try:
+                parts.extend([Text(), Markdown(tail)])
+            except Exception:
+                parts.extend([Text(), Text(tail)])
+        return Panel(Group(*parts), title=self.title, border_style="green")
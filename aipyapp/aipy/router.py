@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+from collections import defaultdict
+
+# 轮次类型：任务指令、代码执行出错后的修复、代码执行成功后的总结
+ROUTES = ('plan', 'repair', 'summary')
+
+class ClientStats:
+    """ 单个 LLM 每轮耗时和成功率的指数移动平均 """
+    ALPHA = 0.3
+
+    def __init__(self):
+        self.rounds = 0
+        self.latency = None
+        self.success = 1.0
+
+    def add(self, latency, ok):
+        self.rounds += 1
+        self.success += self.ALPHA * ((1.0 if ok else 0.0) - self.success)
+        if ok:
+            self.latency = latency if self.latency is None else self.latency + self.ALPHA * (latency - self.latency)
+
+class Router:
+    """ 按轮次类型选择 LLM
+
+    - 每种轮次配置一个候选 LLM 列表，没有配置的轮次使用当前 LLM
+    - adaptive 为 True 时，在成功率不低于 min_success 的候选里选择平均耗时最短的，
+      还没有耗时数据的候选优先，保证每个候选都会被试用
+    - adaptive 为 False 时使用列表里第一个成功率达标的候选
+    """
+    def __init__(self, config):
+        self.rules = {route: list(config.get(route, [])) for route in ROUTES}
+        self.adaptive = config.get('adaptive', True)
+        self.min_success = config.get('min_success', 0.8)
+        self.stats = defaultdict(ClientStats)
+        self._lock = threading.Lock()
+
+    def select(self, route, available):
+        """ 返回 LLM 名称，没有可用的候选时返回 None """
+        names = [name for name in self.rules.get(route, []) if name in available]
+        if not names:
+            return None
+        with self._lock:
+            healthy = [name for name in names if self.stats[name].success >= self.min_success] or names
+            if not self.adaptive:
+                return healthy[0]
+            # 排序是稳定的，耗时相同或都没有数据时保持配置的顺序
+            return min(healthy, key=lambda name: self.stats[name].latency or 0)
+
+    def update(self, name, latency, ok):
+        with self._lock:
+            self.stats[name].add(latency, ok)
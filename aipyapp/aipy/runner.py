@@ -5,14 +5,15 @@ import os
 import sys
 import json
 import traceback
-from io import StringIO
+from functools import partial
 from importlib.util import find_spec
 
-from term_image.image import from_file, from_url
-
 from . import utils
 from .i18n import T
 from .interface import Runtime
+from .meter import ResourceMeter, summarize
+from .serialize import ResultSerializer
+from .capture import OutputCapture
 
 INIT_IMPORTS = """
 import os
@@ -31,20 +32,116 @@ def is_json_serializable(obj):
     except (TypeError, OverflowError):
         return False
 
-def diff_dicts(dict1, dict2):
-    diff = {}
-    for key, value in dict1.items():
-        if key not in dict2 or dict2[key] != value:
-            diff[key] = value
-    return diff
+class TrackedDict(dict):
+    """ 记录被写入过的键的字典，代码块执行后只需要查看这些键，不需要复制和比较整个字典
+
+    只跟踪对字典本身的写入，值的原地修改(如 list.append)不会被记录
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.changed = set()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.changed.add(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.changed.add(key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def pop(self, key, *args):
+        if key in self:
+            self.changed.add(key)
+        return super().pop(key, *args)
+
+    def popitem(self):
+        key, value = super().popitem()
+        self.changed.add(key)
+        return key, value
+
+    def clear(self):
+        self.changed.update(self.keys())
+        super().clear()
+
+    def reset(self):
+        self.changed = set()
+
+    def get_changes(self):
+        """ 返回被写入且仍然存在的键和值 """
+        return {key: self[key] for key in self.changed if key in self}
+
+# 记录到执行历史里的单个值的上限，超出时只记录摘要
+MAX_RECORD_ITEMS = 100
+MAX_RECORD_BYTES = 4096
+
+def summarize_value(value):
+    summary = {'__summary__': type(value).__name__}
+    shape = getattr(value, 'shape', None)
+    if shape is not None:
+        summary['shape'] = list(shape)
+    elif hasattr(value, '__len__'):
+        try:
+            summary['len'] = len(value)
+        except TypeError:
+            pass
+    return summary
+
+def record_value(value):
+    """ 可以 JSON 序列化的小值原样记录，大值或不能序列化的值记录摘要 """
+    if hasattr(value, 'shape'):
+        return summarize_value(value)
+    if isinstance(value, (list, tuple, dict, set)) and len(value) > MAX_RECORD_ITEMS:
+        return summarize_value(value)
+    if isinstance(value, (str, bytes)) and len(value) > MAX_RECORD_BYTES:
+        return summarize_value(value)
+    try:
+        data = json.dumps(value)
+    except (TypeError, ValueError, OverflowError):
+        return summarize_value(value)
+    return value if len(data) <= MAX_RECORD_BYTES else summarize_value(value)
+
+def is_summary(value):
+    return isinstance(value, dict) and '__summary__' in value
+
+# 异常堆栈最多保留的帧数
+MAX_TRACEBACK_FRAMES = 6
+
+def format_traceback(e):
+    """ 去掉 Runner 自身的帧，只保留代码块里的帧和最终出错的帧，省略的帧注明数量 """
+    frames = traceback.extract_tb(e.__traceback__)[1:]
+    last = len(frames) - 1
+    keep = [i for i, frame in enumerate(frames) if frame.filename == '<string>' or i == last]
+    if len(keep) > MAX_TRACEBACK_FRAMES:
+        half = MAX_TRACEBACK_FRAMES // 2
+        keep = keep[:half] + keep[-half:]
+    lines = ['Traceback (most recent call last):\n']
+    prev = -1
+    for i in keep:
+        if i > prev + 1:
+            lines.append(f"  ... {i - prev - 1} frames omitted\n")
+        lines.extend(traceback.format_list([frames[i]]))
+        prev = i
+    lines.extend(traceback.format_exception_only(type(e), e))
+    return ''.join(lines)
 
 class Runner(Runtime):
     def __init__(self, console, settings):
         self._console = console
         self._settings = settings
-        self.env = {}
+        self.env = TrackedDict()
         self._auto_install = settings.get('auto_install')
         self._auto_getenv = settings.get('auto_getenv')
+        self._feedback = settings.get('feedback', {})
+        self._capture = settings.get('capture', {})
         for key, value in os.environ.items():
             if key == 'LC_TERMINAL':
                 self.setenv(key, value, '终端应用程序')
@@ -54,11 +151,15 @@ class Runner(Runtime):
 
     def clear(self):
         self.history = [{'env': self.env}]
-        self._globals = {'runtime': self, '__session__': {}, '__name__': '__main__', 'input': self.input, '__history__': self.history}
+        self._globals = {'runtime': self, '__session__': TrackedDict(), '__name__': '__main__', 'input': self.input, '__history__': self.history}
         exec(INIT_IMPORTS, self._globals)
 
     def __repr__(self):
         return f"<Runner history={len(self.history)}, env={len(self.env)}>"
+
+    def restore_session(self, session):
+        """ 恢复任务时写入 __session__ """
+        self._globals['__session__'].update(session)
     
     @property
     def globals(self):
@@ -66,43 +167,60 @@ class Runner(Runtime):
     
     def __call__(self, code_str):
         old_stdout, old_stderr = sys.stdout, sys.stderr
-        captured_stdout = StringIO()
-        captured_stderr = StringIO()
+        captured_stdout = self.get_capture('stdout')
+        captured_stderr = self.get_capture('stderr')
         sys.stdout, sys.stderr = captured_stdout, captured_stderr
         result = {}
-        env = self.env.copy()
-        session = self._globals['__session__'].copy()
+        session = self._globals['__session__']
+        self.env.reset()
+        session.reset()
+        # 代码块之间只保留 __session__，每个代码块使用 globals 的浅复制
         gs = self._globals.copy()
         gs['__result__'] = {}
+        meter = ResourceMeter()
         try:
             exec(code_str, gs)
         except (SystemExit, Exception) as e:
             result['errstr'] = str(e)
-            result['traceback'] = traceback.format_exc()
+            result['traceback'] = format_traceback(e)
         finally:
             sys.stdout = old_stdout
             sys.stderr = old_stderr
+            captured_stdout.close()
+            captured_stderr.close()
+        stats = meter.stop()
 
+        # 错误信息、输出和 __result__ 共享同一个大小上限，按这个顺序一次完成转换
+        serializer = self.get_serializer()
+        for key in ('errstr', 'traceback'):
+            if key in result:
+                result[key] = serializer(result[key])
         s = captured_stdout.getvalue().strip()
-        if s: result['stdout'] = s if is_json_serializable(s) else '<filtered: cannot json-serialize>'
+        if s: result['stdout'] = serializer(s)
         s = captured_stderr.getvalue().strip()
-        if s: result['stderr'] = s if is_json_serializable(s) else '<filtered: cannot json-serialize>'        
+        if s: result['stderr'] = serializer(s)
 
         vars = gs.get('__result__')
         if vars:
-            result['__result__'] = self.filter_result(vars)
+            result['__result__'] = serializer(vars)
+        if serializer.truncated:
+            result['truncated'] = True
+        result['stats'] = stats
 
         history = {'code': code_str, 'result': result}
 
-        diff = diff_dicts(env, self.env)
-        if diff:
-            history['env'] = diff
-        diff = diff_dicts(gs['__session__'], session)
-        if diff:
-            history['session'] = diff
+        changes = self.env.get_changes()
+        if changes:
+            history['env'] = changes
+        changes = session.get_changes()
+        if changes:
+            history['session'] = {key: record_value(value) for key, value in changes.items()}
 
         self.history.append(history)
         return result
+
+    def get_summary(self):
+        return summarize(self.history)
     
     @utils.restore_output
     def install_packages(self, packages):
@@ -137,6 +255,8 @@ class Runner(Runtime):
     
     @utils.restore_output
     def display(self, path=None, url=None):
+        # term_image 导入较慢，只在显示图片时导入
+        from term_image.image import from_file, from_url
         if path:
             image = from_file(path)
             image.draw()
@@ -144,6 +264,23 @@ class Runner(Runtime):
             image = from_url(url)
             image.draw()
 
+    @utils.restore_output
+    def stream(self, text, name='stdout'):
+        """ 实时显示代码块执行过程中的输出 """
+        style = 'dim red' if name == 'stderr' else 'dim'
+        self._console.print(text, style=style, end='', markup=False, highlight=False)
+
+    def get_capture(self, name):
+        config = self._capture
+        interval = config.get('live_interval', 0.5)
+        return OutputCapture(
+            head=config.get('head', 8192),
+            tail=config.get('tail', 8192),
+            stream=partial(self.stream, name=name) if interval else None,
+            interval=interval,
+            live_max=config.get('live_max', 2000),
+        )
+
     @utils.restore_output
     def input(self, prompt=''):
         return self._console.input(prompt)
@@ -151,16 +288,8 @@ class Runner(Runtime):
     def setenv(self, name, value, desc):
         self.env[name] = (value, desc)
 
+    def get_serializer(self):
+        return ResultSerializer.from_config(self.env, self._feedback)
+
     def filter_result(self, vars):
-        if isinstance(vars, dict):
-            for key in vars.keys():
-                if key in self.env:
-                    vars[key] = '<masked>'
-                else:
-                    vars[key] = self.filter_result(vars[key])
-        elif isinstance(vars, list):
-            vars = [self.filter_result(v) for v in vars]
-        else:
-            vars = vars if is_json_serializable(vars) else '<filtered>'
-        return vars
-    
\ No newline at end of file
+        return self.get_serializer()(vars)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import pickle
+import signal
+import linecache
+import threading
+import multiprocessing
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from .i18n import T
+from .runner import Runner
+
+def set_memory_limit(limit):
+    if not (resource and limit):
+        return
+    limit = int(limit * 1024 * 1024)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def set_cpu_limit(seconds):
+    """ 设置本进程的 CPU 时间软限制为“已用时间 + seconds”，seconds 为 0 时取消限制 """
+    if not resource:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if seconds:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = int(usage.ru_utime + usage.ru_stime + seconds) + 1
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+    else:
+        soft = hard
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+def on_cpu_limit(signum, frame):
+    raise TimeoutError(T('cpu_timeout'))
+
+def picklable(data):
+    ret = {}
+    for key, value in data.items():
+        try:
+            pickle.dumps(value)
+        except Exception:
+            value = '<filtered>'
+        ret[key] = value
+    return ret
+
+class WorkerRuntime(Runner):
+    """ 工作进程里的 Runner，runtime 的交互方法转发给父进程执行 """
+    def __init__(self, conn, settings=None):
+        self._conn = conn
+        super().__init__(None, settings or {})
+
+    def _call_parent(self, name, *args, **kwargs):
+        self._conn.send(('call', name, args, kwargs))
+        _, value = self._conn.recv()
+        return value
+
+    def install_packages(self, packages):
+        return self._call_parent('install_packages', packages)
+
+    def getenv(self, name, desc=None):
+        value = self._call_parent('getenv', name, desc)
+        if value:
+            self.setenv(name, value, desc)
+        return value
+
+    def display(self, path=None, url=None):
+        return self._call_parent('display', path=path, url=url)
+
+    def input(self, prompt=''):
+        return self._call_parent('input', prompt)
+
+    def stream(self, text, name='stdout'):
+        return self._call_parent('stream', text, name)
+
+def worker_main(conn, cpu_timeout, memory_limit, settings):
+    # Ctrl-C 由父进程处理：父进程决定是否终止工作进程
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # spawn 启动命令注册为 <string> 的源码，会混进代码块的异常堆栈
+    linecache.cache.pop('<string>', None)
+    if resource:
+        signal.signal(signal.SIGXCPU, on_cpu_limit)
+    set_memory_limit(memory_limit)
+
+    runner = WorkerRuntime(conn, settings)
+    conn.send(('ready',))
+    while True:
+        try:
+            cmd, data, env = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if cmd == 'session':
+            runner.restore_session(data)
+            continue
+        if cmd != 'exec':
+            continue
+        runner.env.clear()
+        runner.env.update(env)
+        set_cpu_limit(cpu_timeout)
+        try:
+            result = runner(data)
+        finally:
+            set_cpu_limit(0)
+        history = dict(runner.history[-1])
+        for key in ('env', 'session'):
+            if key in history:
+                history[key] = picklable(history[key])
+        conn.send(('result', result, history))
+
+class SubprocessRunner(Runner):
+    """ 在常驻的工作进程里执行代码块
+
+    - 工作进程在代码块之间保留 globals 和 __session__
+    - 支持每个代码块的墙钟时间、CPU 时间限制和工作进程内存上限
+    - 超时、崩溃或 Ctrl-C 只终止工作进程，下一个代码块会启动新的工作进程
+    - runtime.getenv/install_packages/display/input 在父进程里执行
+    - 恢复任务时的 __session__ 在工作进程启动时发送给它
+    """
+    POLL_INTERVAL = 0.1
+    START_TIMEOUT = 60
+
+    def __init__(self, console, settings):
+        config = settings.get('sandbox', {})
+        self._timeout = config.get('timeout', 0)
+        self._cpu_timeout = config.get('cpu_timeout', 0)
+        self._memory_limit = config.get('memory_limit', 0)
+        self._process = None
+        self._conn = None
+        self._stop_lock = threading.Lock()
+        super().__init__(console, settings)
+
+    def __repr__(self):
+        pid = self._process.pid if self._process else None
+        return f"<SubprocessRunner pid={pid}, history={len(self.history)}, env={len(self.env)}>"
+
+    def clear(self):
+        super().clear()
+        self.stop()
+        self._session = {}
+
+    def restore_session(self, session):
+        """ 只发送一次：之后工作进程被终止时 __session__ 和没有恢复的任务一样被清空 """
+        if self.alive:
+            self._conn.send(('session', picklable(session), None))
+        else:
+            self._session.update(session)
+
+    def start(self):
+        ctx = multiprocessing.get_context('spawn')
+        self._conn, child_conn = ctx.Pipe()
+        self._process = ctx.Process(
+            target=worker_main,
+            args=(child_conn, self._cpu_timeout, self._memory_limit, self.get_worker_settings()),
+            daemon=True
+        )
+        self._process.start()
+        child_conn.close()
+        # 等待工作进程完成初始化，启动时间不计入代码块的执行时间
+        if not self._conn.poll(self.START_TIMEOUT):
+            self.stop()
+            raise RuntimeError(T('worker_start_failed'))
+        self._conn.recv()
+        if self._session:
+            self._conn.send(('session', picklable(self._session), None))
+            self._session = {}
+
+    def stop(self):
+        """ 可以重复调用，也可以在不同线程同时调用：只有一个调用者取得工作进程并清理 """
+        with self._stop_lock:
+            process, self._process = self._process, None
+            conn, self._conn = self._conn, None
+        if process:
+            if process.is_alive():
+                process.kill()
+            process.join()
+        if conn:
+            conn.close()
+
+    def kill(self):
+        """ 可以在其它线程调用：终止正在执行的代码块，执行线程自己负责清理 """
+        process = self._process
+        if process and process.is_alive():
+            process.kill()
+
+    def get_worker_settings(self):
+        """ 工作进程里的 Runner 需要的配置 """
+        return {'feedback': dict(self._feedback), 'capture': dict(self._capture)}
+
+    @property
+    def alive(self):
+        return self._process is not None and self._process.is_alive()
+
+    def __call__(self, code_str):
+        if not self.alive:
+            self.stop()
+            self.start()
+
+        start = time.perf_counter()
+        self._conn.send(('exec', code_str, dict(self.env)))
+        try:
+            result, history = self._wait()
+        except KeyboardInterrupt:
+            self.stop()
+            stats = {'wall_time': round(time.perf_counter() - start, 3)}
+            self.history.append({'code': code_str, 'result': {'errstr': T('worker_interrupted'), 'stats': stats}})
+            raise
+
+        if history is None:
+            result['stats'] = {'wall_time': round(time.perf_counter() - start, 3)}
+            history = {'code': code_str, 'result': result}
+        self.history.append(history)
+        return result
+
+    def _wait(self):
+        deadline = time.monotonic() + self._timeout if self._timeout else None
+        while True:
+            if self._conn.poll(self.POLL_INTERVAL):
+                try:
+                    msg = self._conn.recv()
+                except EOFError:
+                    self._process.join(1)
+                    code = self._process.exitcode
+                    self.stop()
+                    return {'errstr': T('worker_exited', code)}, None
+                if msg[0] == 'result':
+                    return msg[1], msg[2]
+                # 等待用户输入的时间不计入执行时间
+                start = time.monotonic()
+                _, name, args, kwargs = msg
+                self._conn.send(('reply', getattr(self, name)(*args, **kwargs)))
+                if deadline:
+                    deadline += time.monotonic() - start
+            elif not self._process.is_alive():
+                code = self._process.exitcode
+                self.stop()
+                return {'errstr': T('worker_exited', code)}, None
+            elif deadline and time.monotonic() > deadline:
+                self.stop()
+                return {'errstr': T('worker_timeout', self._timeout)}, None
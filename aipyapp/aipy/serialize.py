@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+
+# 不导入 numpy/pandas，按类型所在的模块和类名识别
+NUMPY_ARRAY = ('numpy', 'ndarray')
+PANDAS_FRAME = ('pandas', 'DataFrame')
+PANDAS_SERIES = ('pandas', 'Series')
+
+def type_key(obj):
+    cls = type(obj)
+    return cls.__module__.split('.')[0], cls.__name__
+
+class ResultSerializer:
+    """ 一次遍历把执行结果转换为可以 JSON 序列化、大小有上限的数据
+
+    - 字典里和 env 同名的键的值替换为 <masked>
+    - 长字符串、长列表只保留开头和结尾，注明省略了多少
+    - numpy 数组、pandas DataFrame/Series 转换为 shape/dtype/预览 的摘要
+    - 不能序列化的值替换为 <filtered>
+    - 累计大小(近似的 JSON 字节数)超过 max_bytes 后，剩余的内容全部省略
+    """
+    MAX_BYTES = 16384
+    MAX_STRING = 2000
+    MAX_ITEMS = 50
+    MAX_DEPTH = 20
+    PREVIEW_ROWS = 5
+
+    def __init__(self, masked=(), max_bytes=None, max_string=None, max_items=None):
+        self.masked = masked
+        self.max_bytes = max_bytes or self.MAX_BYTES
+        self.max_string = max_string or self.MAX_STRING
+        self.max_items = max_items or self.MAX_ITEMS
+        self.size = 0
+        self.truncated = False
+
+    @classmethod
+    def from_config(cls, masked, config):
+        config = config or {}
+        return cls(masked, config.get('max_bytes'), config.get('max_string'), config.get('max_items'))
+
+    @property
+    def full(self):
+        return self.size >= self.max_bytes
+
+    def __call__(self, obj, depth=0):
+        if obj is None or isinstance(obj, bool):
+            self.size += 5
+            return obj
+        if isinstance(obj, (int, float)):
+            self.size += 8
+            return obj if not isinstance(obj, float) or math.isfinite(obj) else str(obj)
+        if isinstance(obj, str):
+            return self.encode_str(obj)
+        if depth >= self.MAX_DEPTH:
+            return self.encode_str('<max depth>')
+        if isinstance(obj, dict):
+            return self.encode_dict(obj, depth)
+        if isinstance(obj, (list, tuple, set, frozenset)):
+            return self.encode_list(list(obj) if isinstance(obj, (set, frozenset)) else obj, depth)
+
+        key = type_key(obj)
+        if key == NUMPY_ARRAY:
+            return self.encode_array(obj, depth)
+        if key == PANDAS_FRAME:
+            return self.encode_frame(obj, depth)
+        if key == PANDAS_SERIES:
+            return self.encode_series(obj, depth)
+        # numpy 标量
+        if key[0] == 'numpy' and hasattr(obj, 'item'):
+            return self(obj.item(), depth)
+        return self.encode_str('<filtered>')
+
+    def encode_str(self, s):
+        if len(s) > self.max_string:
+            head = self.max_string * 2 // 3
+            tail = self.max_string - head
+            s = f"{s[:head]}\n...[{len(s) - head - tail} chars omitted]...\n{s[-tail:]}"
+        remain = self.max_bytes - self.size
+        if len(s) > remain:
+            s = f"{s[:max(remain, 0)]}...[{len(s) - max(remain, 0)} chars omitted: result too large]"
+            self.truncated = True
+        self.size += len(s.encode('utf-8', 'replace')) + 2
+        return s
+
+    def encode_dict(self, obj, depth):
+        ret = {}
+        self.size += 2
+        for i, (key, value) in enumerate(obj.items()):
+            if self.full:
+                ret['...'] = f"[{len(obj) - i} keys omitted: result too large]"
+                self.truncated = True
+                break
+            key = key if isinstance(key, str) else str(key)
+            self.size += len(key) + 4
+            ret[key] = '<masked>' if key in self.masked else self(value, depth + 1)
+        return ret
+
+    def encode_list(self, obj, depth):
+        n = len(obj)
+        self.size += 2
+        if n > self.max_items:
+            head = self.max_items * 2 // 3
+            tail = self.max_items - head
+            items = self.encode_items(obj[:head], depth)
+            items.append(f"...[{n - head - tail} items omitted]...")
+            items.extend(self.encode_items(obj[n - tail:], depth))
+            return items
+        return self.encode_items(obj, depth)
+
+    def encode_items(self, items, depth):
+        ret = []
+        for i, item in enumerate(items):
+            if self.full:
+                ret.append(f"...[{len(items) - i} items omitted: result too large]")
+                self.truncated = True
+                break
+            ret.append(self(item, depth + 1))
+            self.size += 2
+        return ret
+
+    def encode_array(self, obj, depth):
+        preview = obj.reshape(-1)[:self.max_items].tolist() if obj.ndim else obj.tolist()
+        return {
+            '__type__': 'numpy.ndarray',
+            'shape': list(obj.shape),
+            'dtype': str(obj.dtype),
+            'preview': self(preview, depth + 1),
+        }
+
+    def encode_frame(self, obj, depth):
+        columns = {str(name): str(dtype) for name, dtype in obj.dtypes.items()}
+        rows = obj.head(self.PREVIEW_ROWS).to_dict('records')
+        return {
+            '__type__': 'pandas.DataFrame',
+            'shape': list(obj.shape),
+            'columns': self(columns, depth + 1),
+            'preview': self(rows, depth + 1),
+        }
+
+    def encode_series(self, obj, depth):
+        return {
+            '__type__': 'pandas.Series',
+            'name': self(obj.name, depth + 1),
+            'shape': list(obj.shape),
+            'dtype': str(obj.dtype),
+            'preview': self(obj.head(self.PREVIEW_ROWS).tolist(), depth + 1),
+        }
+
+def filter_stats(result, min_time=0):
+    """ 资源统计保存在执行历史和任务日志里，只有代码块执行时间不少于 min_time 秒时才反馈给 LLM，
+    min_time 为 0 时从不反馈
+    """
+    stats = result.get('stats')
+    if not stats or (min_time and stats.get('wall_time', 0) >= min_time):
+        return result
+    return {key: value for key, value in result.items() if key != 'stats'}
+
+def compact_result(result, previous=None):
+    """ 精简反馈给 LLM 的执行结果
+
+    - __result__ 里和上一轮相同的值省略，键名列在 __unchanged__ 里
+    - stats 里为 0 的项省略
+    """
+    result = dict(result)
+    stats = {key: value for key, value in result.pop('stats', {}).items() if value}
+    if stats:
+        result['stats'] = stats
+    current = result.get('__result__')
+    if isinstance(current, dict) and isinstance(previous, dict):
+        unchanged = [key for key, value in current.items() if key in previous and previous[key] == value]
+        if unchanged:
+            current = {key: value for key, value in current.items() if key not in unchanged}
+            current['__unchanged__'] = unchanged
+            result['__result__'] = current
+    return result
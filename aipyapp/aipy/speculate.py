@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import copy
+import time
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from rich.console import Console
+
+from .i18n import T
+from .fence import FenceDetector
+from .hedge import close_response
+from .sandbox import SubprocessRunner
+
+def quiet_console():
+    return Console(file=io.StringIO(), record=False)
+
+class BranchRunner(SubprocessRunner):
+    """ 推测执行分支使用的 Runner
+
+    - 每个分支有自己的工作进程，globals 和 __session__ 互相隔离，工作目录是共享的
+    - 并发执行时不显示输出，也不询问用户：缺少的环境变量为空，
+      需要安装的包只在 auto_install 为 true 时安装
+    - 被选中的分支调用 adopt 后作为 Agent 的 Runner 继续使用
+    """
+    def __init__(self, console, settings, env):
+        super().__init__(quiet_console(), settings)
+        self._main_console = console
+        self._auto_getenv = True
+        self._auto_install = bool(settings.get('auto_install'))
+        self.env.update(env)
+
+    def adopt(self):
+        self._console = self._main_console
+        self._auto_getenv = self._settings.get('auto_getenv')
+        self._auto_install = self._settings.get('auto_install')
+        return self
+
+class Branch:
+    """ 一个 LLM 的回复和它的代码执行结果 """
+    def __init__(self, client, history, runner):
+        self.name = client.name
+        # 客户端的浅复制，回复渲染到不显示的 console，不影响其它分支
+        self.client = copy.copy(client)
+        self.client.console = quiet_console()
+        self.history = history
+        self.runner = runner
+        self.response = None
+        self.msg = None
+        self.code = None
+        self.result = None
+        self.time = 0
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+    @property
+    def ok(self):
+        """ 收到了回复，并且回复里没有代码或者代码执行没有出错 """
+        if self.msg is None:
+            return False
+        if self.code is None:
+            return True
+        # 没有消息的异常(例如 assert 1 == 2)的 errstr 是空字符串，所以判断有没有这一项
+        return self.result is not None and 'errstr' not in self.result
+
+    def run(self, instruction, system_prompt):
+        start = time.time()
+        try:
+            self._run(instruction, system_prompt)
+        finally:
+            self.time = round(time.time() - start, 3)
+        return self
+
+    def _run(self, instruction, system_prompt):
+        client = self.client
+        history = self.history
+        history.add("system", system_prompt)
+        history.add("user", instruction)
+        messages = history.get_messages()
+        msg = client.get_cached(messages, live=False)
+        if not msg:
+            start = time.time()
+            self.response = client.get_completion(messages)
+            if not self.response or self.cancelled:
+                return
+            msg = client.parse_response(self.response)
+            msg.usage['time'] = round(time.time() - start, 3)
+            client.put_cached(messages, msg)
+        msg.llm = self.name
+        history.add_message(msg)
+        self.msg = msg
+
+        self.code = msg.tool_call['code'] if msg.tool_call else FenceDetector.parse(msg.content)
+        if self.code is None:
+            return
+        # 取消和启动工作进程互斥，保证取消之后不会再启动新的工作进程
+        with self._lock:
+            if self.cancelled:
+                return
+            self.runner.start()
+        self.result = self.runner(self.code)
+
+    def get_usage(self):
+        """ 分支消耗的 tokens：收到回复时取回复的用量，请求已经发出但被取消时按估算的输入 tokens 计算
+
+        分支并发执行，LLM 时间不计入任务的用量
+        """
+        if self.msg is not None:
+            usage = Counter(self.msg.usage)
+        elif self.response is not None:
+            tokens = self.client._input_tokens
+            usage = Counter(input_tokens=tokens, total_tokens=tokens)
+        else:
+            usage = Counter()
+        usage.pop('time', None)
+        return usage
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+        close_response(self.response)
+        self.runner.kill()
+
+    def show(self, console):
+        """ 在主 console 上显示被选中分支的回复 """
+        from .render import StreamRenderer
+        with StreamRenderer(console, self.name, live=False) as renderer:
+            renderer.feed(self.msg.content)
+
+    def get_status(self):
+        if self.ok:
+            return T('branch_ok')
+        if self.result is not None:
+            return T('branch_error')
+        if self.cancelled:
+            return T('branch_cancelled')
+        return T('call_failed')
+
+class Speculator:
+    """ 推测执行：任务指令同时发给多个 LLM，使用第一个代码执行成功的回复
+
+    - 每个分支的代码在自己的工作进程里执行
+    - 有分支成功后取消其它分支：关闭回复流，终止正在执行的代码
+    - 所有分支都失败时，使用最先结束并且收到了回复的分支，进入正常的出错修复流程
+    - 没有被选中的分支消耗的 tokens 也要计入任务的用量
+    """
+    def __init__(self, console, settings):
+        config = settings.get('speculate', {})
+        self.console = console
+        self.settings = settings
+        self.llms = config.get('llms', [])
+        self.max_branches = config.get('max_branches', 3)
+
+    def get_candidates(self, llm):
+        names = [name for name in (self.llms or list(llm.configs)) if name in llm]
+        clients = [llm.get(name) for name in names]
+        return [client for client in clients if client][:self.max_branches]
+
+    def __call__(self, llm, runner, instruction, system_prompt):
+        """ 返回 (选中的 Branch, 其它分支消耗的 tokens)，候选 LLM 少于两个或者全部调用失败时 Branch 为 None """
+        candidates = self.get_candidates(llm)
+        if len(candidates) < 2:
+            return None, Counter()
+
+        branches = [Branch(client, llm.new_history(), BranchRunner(self.console, self.settings, runner.env)) for client in candidates]
+        start = time.time()
+        executor = ThreadPoolExecutor(max_workers=len(branches))
+        futures = {executor.submit(branch.run, instruction, system_prompt): branch for branch in branches}
+        finished = []
+        winner = None
+        self.console.record = False
+        try:
+            with self.console.status(f"[dim white]{T('speculating', ', '.join(branch.name for branch in branches))} ..."):
+                pending = set(futures)
+                while pending and not winner:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        branch = futures[future]
+                        if future.exception() is None and branch.msg is not None:
+                            finished.append(branch)
+                            if branch.ok:
+                                winner = branch
+                                break
+                winner = winner or (finished[0] if finished else None)
+        finally:
+            self.console.record = True
+            for future, branch in futures.items():
+                if branch is not winner:
+                    branch.cancel()
+                    future.add_done_callback(lambda f, branch=branch: branch.runner.stop())
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        elapsed = round(time.time() - start, 3)
+        usage = Counter()
+        for branch in branches:
+            branch_usage = branch.get_usage()
+            if branch is not winner:
+                usage += branch_usage
+            tokens = branch_usage['input_tokens'] + branch_usage['output_tokens']
+            self.console.print(f"[dim]{T('branch_status', branch.name, branch.get_status(), branch.time or elapsed, tokens)}")
+        if winner:
+            self.console.print(f"[green]{T('speculate_winner', winner.name, elapsed)}")
+        return winner, usage
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import time
+from pathlib import Path
+from collections import Counter
+
+def json_default(obj):
+    return '<filtered: cannot json-serialize>'
+
+class TaskLog:
+    """ 任务目录里的追加式事件日志 events.jsonl，每行一个事件：
+
+    - task: 任务开始，记录 task_id、instruction 和初始 env
+    - message: ChatHistory 新增的消息，index 是消息在对话历史里的位置
+    - exec: Runner.history 新增的记录，index 是记录在执行历史里的位置
+    - usage: 没有对应消息的用量，如推测执行没有被选中的分支消耗的 tokens
+    - resume: 从日志恢复任务
+
+    每个事件写入后立即 flush，进程崩溃时最多丢失正在写入的一行。
+    task.json 是从日志压缩出来的视图：同一个 index 的事件以最后一次为准。
+    """
+    FILENAME = 'events.jsonl'
+
+    def __init__(self, path):
+        self.dir = Path(path)
+        self.path = self.dir / self.FILENAME
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def write(self, type, **data):
+        event = {'type': type, 'time': round(time.time(), 3), **data}
+        self._file.write(json.dumps(event, ensure_ascii=False, default=json_default) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    @classmethod
+    def read(cls, path):
+        """ 逐行读取事件，跳过崩溃时没有写完的行 """
+        with open(Path(path) / cls.FILENAME, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    @classmethod
+    def load(cls, path):
+        """ 按 index 合并事件，返回和 task.json 相同结构的任务
+
+        executed: LLM 回复的 index -> 执行这个回复里代码的记录在 runner 里的 index
+        """
+        task = {'task_id': None, 'instruction': None, 'env': {}, 'executed': {}, 'usage': Counter()}
+        messages = {}
+        records = {}
+        for event in cls.read(path):
+            kind = event['type']
+            if kind == 'task':
+                task.update(task_id=event.get('task_id'), instruction=event.get('instruction'), env=event.get('env', {}))
+            elif kind == 'message':
+                messages[event['index']] = event['message']
+            elif kind == 'exec':
+                records[event['index']] = event['record']
+                task['executed'][event['reply']] = event['index']
+            elif kind == 'usage':
+                task['usage'] += Counter(event['usage'])
+        task['llm'] = [messages[i] for i in sorted(messages)]
+        task['runner'] = [{'env': task['env']}] + [records[i] for i in sorted(records)]
+        return task
+
+    @classmethod
+    def compact(cls, path, output):
+        task = cls.load(path)
+        task = {'instruction': task['instruction'], 'llm': task['llm'], 'runner': task['runner']}
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(task, f, ensure_ascii=False, default=json_default)
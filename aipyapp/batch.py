@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import importlib.resources as resources
+
+from rich.console import Console
+
+from . import __version__
+from .aipy import Agent
+from .aipy.i18n import T
+from .aipy.config import ConfigManager
+
+__PACKAGE_NAME__ = "aipyapp"
+
+# 每个工作进程一个 Agent，任务之间用 Agent.done() 清空 ChatHistory 和 Runner
+_agent = None
+
+def share_rate_limits(settings, workers):
+    """ 每个工作进程有自己的 RateLimiter，按工作进程数平分各个 LLM 的 rpm/tpm，合计不超过配置的额度 """
+    for name, config in settings.get('llm', {}).items():
+        for key in ('rpm', 'tpm'):
+            if config.get(key):
+                settings.set(f'llm.{name}.{key}', config[key] / workers)
+
+def init_worker(default_config, user_config, workers):
+    """ 工作进程初始化
+
+    Agent 会切换当前目录、重定向 sys.stdout，所以每个任务必须在独立进程里运行。
+    工作进程的标准输出重定向到 /dev/null，避免污染结果流。
+    没有人回答提示：缺少的环境变量为空，需要安装的包只在用户配置了 auto_install 时安装，
+    标准输入也指向 /dev/null，代码块里的 input() 立即出错而不是一直等待。
+    配置的 rpm/tpm 是所有工作进程合计的上限。
+    """
+    global _agent
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    sys.stdin = open(os.devnull, encoding='utf-8')
+    settings = ConfigManager(default_config, user_config).get_config()
+    settings.set('auto_getenv', True)
+    settings.set('auto_install', bool(settings.get('auto_install')))
+    share_rate_limits(settings, workers)
+    _agent = Agent(settings, console=Console(record=True))
+
+def get_answer(history):
+    for msg in reversed(history.messages):
+        if msg.role == 'assistant':
+            return msg.content
+    return None
+
+def run_task(task):
+    ai = _agent
+    result = {'id': task.get('id'), 'llm': task.get('llm')}
+    start = time.time()
+    try:
+        ai(task['instruction'], llm=task.get('llm'))
+        history = ai.llm.history
+        summary = history.get_summary()
+        result['task_id'] = ai.task_id
+        result['task_dir'] = str(ai._cwd / ai.task_id) if ai.task_id else None
+        result['answer'] = get_answer(history)
+        result['rounds'] = summary['rounds']
+        result['input_tokens'] = summary['input_tokens']
+        result['output_tokens'] = summary['output_tokens']
+        result['total_tokens'] = summary['total_tokens']
+        result['llm_time'] = round(summary['time'], 3)
+        result['ok'] = True
+    except BaseException as e:
+        result['ok'] = False
+        result['error'] = f"{e.__class__.__name__}: {e}"
+    finally:
+        try:
+            ai.done()
+        except Exception:
+            pass
+    result['wall_time'] = round(time.time() - start, 3)
+    return result
+
+def load_tasks(path):
+    tasks = []
+    with open(path, encoding='utf-8') as f:
+        for i, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            task = json.loads(line)
+            if isinstance(task, str):
+                task = {'instruction': task}
+            task.setdefault('id', i)
+            tasks.append(task)
+    return tasks
+
+def get_default_llm(settings):
+    default = None
+    for name, config in settings.get('llm', {}).items():
+        if not config.get('enable', True):
+            continue
+        if config.get('default', False):
+            return name
+        default = default or name
+    return default
+
+class BatchRunner():
+    def __init__(self, console, settings, default_config, user_config, workers=None):
+        conf = settings.get('batch', {})
+        self.console = console
+        self.default_config = default_config
+        self.user_config = user_config
+        self.workers = workers or conf.get('workers', 4)
+        self.limits = dict(conf.get('concurrency', {}))
+        self.default_llm = get_default_llm(settings)
+
+    def get_provider(self, task):
+        return task.get('llm') or self.default_llm
+
+    def can_run(self, task, inflight):
+        provider = self.get_provider(task)
+        limit = self.limits.get(provider)
+        return not limit or inflight[provider] < limit
+
+    def run(self, tasks, output):
+        pending = deque(tasks)
+        running = {}
+        inflight = Counter()
+        failed = 0
+        self.console.print(f"[cyan]{T('batch_start', len(tasks), self.workers)}")
+        initargs = (self.default_config, self.user_config, self.workers)
+        with ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=initargs) as pool:
+            while pending or running:
+                # 按提交顺序调度，跳过已达到并发上限的 LLM 的任务
+                for task in list(pending):
+                    if len(running) >= self.workers:
+                        break
+                    if not self.can_run(task, inflight):
+                        continue
+                    pending.remove(task)
+                    inflight[self.get_provider(task)] += 1
+                    running[pool.submit(run_task, task)] = task
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    inflight[self.get_provider(task)] -= 1
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = {'id': task['id'], 'llm': task.get('llm'), 'ok': False, 'error': str(e)}
+                    if not result['ok']:
+                        failed += 1
+                    output.write(json.dumps(result, ensure_ascii=False) + '\n')
+                    output.flush()
+                    self.print_result(result)
+
+        self.console.print(f"[cyan]{T('batch_done', len(tasks), failed)}")
+        return failed
+
+    def print_result(self, result):
+        if result['ok']:
+            self.console.print(f"✅ [green]{result['id']}[/green] | {result['rounds']} | {result['wall_time']}s | Tokens: {result['total_tokens']}")
+        else:
+            self.console.print(f"❌ [red]{result['id']}[/red] | {result['error']}")
+
+def main(args):
+    console = Console(stderr=True)
+    console.print(f"[bold cyan]🚀 Python use - AIPython ({__version__}) [[green]https://www.aipy.app[/green]]")
+
+    path = args.config if args.config else 'aipython.toml'
+    default_config_path = str(resources.files(__PACKAGE_NAME__) / "default.toml")
+    conf = ConfigManager(default_config_path, path)
+    conf.check_config()
+    settings = conf.get_config()
+    if not get_default_llm(settings):
+        console.print(f"[bold red]{T('no_available_llm')}")
+        return 1
+
+    tasks = load_tasks(args.tasks)
+    runner = BatchRunner(console, settings, default_config_path, os.path.abspath(path), workers=args.workers)
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as output:
+            failed = runner.run(tasks, output)
+    else:
+        failed = runner.run(tasks, sys.stdout)
+    return 1 if failed else 0
@@ -54,9 +54,26 @@ class InteractiveConsole():
             self.console.print_exception()
 
     def run_ai_mode(self, initial_text):
-        ai = self.ai
         self.console.print(f"{T('ai_mode_enter')}", style="cyan")
         self.run_ai_task(initial_text)
+        self.ai_mode_loop()
+
+    def resume(self, task_id):
+        """ 恢复中断的任务，之后进入 AI 模式继续对话 """
+        self.console.print(f"{T('ai_mode_enter')}", style="cyan")
+        try:
+            self.ai.resume(task_id)
+        except FileNotFoundError:
+            self.console.print(f"❌ [bold red]{T('task_not_found', task_id)}")
+            return
+        except (EOFError, KeyboardInterrupt):
+            pass
+        except Exception as e:
+            self.console.print_exception()
+        self.ai_mode_loop()
+
+    def ai_mode_loop(self):
+        ai = self.ai
         while True:
             try:
                 user_input = self.input_with_possible_multiline(">>> ", is_ai=True).strip()
@@ -130,4 +147,7 @@ def main(args):
         console.print(f"[bold red]{T('no_available_llm')}")
         return
   
-    InteractiveConsole(ai, console, settings).run()
+    if args.command == 'resume':
+        InteractiveConsole(ai, console, settings).resume(args.task_id)
+    else:
+        InteractiveConsole(ai, console, settings).run()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+使用本地模拟 LLM 服务测量 Agent 端到端吞吐量
+
+对 LLM.CLIENTS 里的每种客户端，分别用流式和非流式方式运行若干次任务，
+输出每个任务的平均耗时和每秒任务数（JSON）。
+
+用法:
+    python benchmarks/bench_agent.py [task.json ...] [--runs 5] [--ttft 0.05] [--token-latency 0.002] [--tools]
+
+--tools 让支持原生工具调用的客户端通过 execute_python 工具提交代码，
+比较 rounds 和 input_tokens 可以看出和代码块解析方式的差别。
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+from contextlib import contextmanager
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from rich.console import Console
+
+from aipyapp.aipy import Agent, LLM
+from aipyapp.aipy.config import ConfigManager
+from aipyapp.aipy.fakellm import FakeLLMServer, Transcripts
+
+DEFAULT_CONFIG = Path(__file__).resolve().parent.parent / 'aipyapp' / 'default.toml'
+
+def base_url(proto, server):
+    if proto in ('ollama', 'claude'):
+        return server.url
+    return f"{server.url}/v1"
+
+def make_settings(workdir, proto, server, stream, tools=False):
+    user_config = Path(workdir) / f"{proto}-{stream}.toml"
+    user_config.write_text(f"""
+workdir = "{workdir}"
+auto_install = true
+auto_getenv = true
+
+[llm.bench]
+type = "{proto}"
+api_key = "fake-api-key"
+base_url = "{base_url(proto, server)}"
+model = "fake"
+stream = {'true' if stream else 'false'}
+tools = {'true' if tools else 'false'}
+default = true
+""")
+    return ConfigManager(str(DEFAULT_CONFIG), str(user_config)).get_config()
+
+@contextmanager
+def quiet_stdout():
+    """ Agent 会向 fd 1 写入提示音，测试期间屏蔽 """
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        yield
+    finally:
+        os.dup2(saved, 1)
+        os.close(devnull)
+        os.close(saved)
+
+def bench(proto, stream, server, instructions, runs, workdir, tools=False):
+    cwd = os.getcwd()
+    settings = make_settings(workdir, proto, server, stream, tools)
+    console = Console(file=io.StringIO(), record=True, width=120)
+    ai = Agent(settings, console=console)
+    requests = server.requests
+    rounds = 0
+    input_tokens = 0
+    tool_calls = 0
+    errors = 0
+    start = time.perf_counter()
+    try:
+        with quiet_stdout():
+            for _ in range(runs):
+                for instruction in instructions:
+                    try:
+                        ai(instruction)
+                        summary = ai.llm.history.get_summary()
+                        rounds += summary['rounds']
+                        input_tokens += summary['input_tokens']
+                        tool_calls += summary['tool_calls']
+                    except Exception:
+                        errors += 1
+                    ai.done()
+    finally:
+        os.chdir(cwd)
+    elapsed = time.perf_counter() - start
+    tasks = runs * len(instructions)
+    return {
+        'client': proto,
+        'stream': stream,
+        'tasks': tasks,
+        'rounds': rounds,
+        'input_tokens': input_tokens,
+        'tool_calls': tool_calls,
+        'requests': server.requests - requests,
+        'errors': errors,
+        'seconds': round(elapsed, 4),
+        'seconds_per_task': round(elapsed / tasks, 4),
+        'tasks_per_second': round(tasks / elapsed, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Agent end-to-end benchmark against the fake LLM server")
+    parser.add_argument('tasks', nargs='*', help="task.json files written by Agent.done")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--ttft', type=float, default=0)
+    parser.add_argument('--token-latency', type=float, default=0)
+    parser.add_argument('--clients', type=str, default=','.join(LLM.CLIENTS), help="Comma separated client types")
+    parser.add_argument('--tools', action='store_true', help="Use native tool calling where supported")
+    args = parser.parse_args()
+
+    transcripts = Transcripts.load(args.tasks)
+    instructions = list(transcripts.tasks)
+    server = FakeLLMServer(transcripts, ttft=args.ttft, token_latency=args.token_latency).start()
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for proto in args.clients.split(','):
+                for stream in (True, False):
+                    results.append(bench(proto, stream, server, instructions, args.runs, workdir, args.tools))
+    finally:
+        server.stop()
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+比较执行结果反馈消息在原格式和精简格式下的大小(字节和估算 tokens)
+
+用一组有代表性的代码块模拟一个多轮任务：正常输出、和上一轮部分相同的 __result__、
+库函数内部抛出的异常、较大的结果。原格式每轮重复任务指令、JSON 缩进 4 格、保留完整的异常堆栈。
+
+用法:
+    python benchmarks/bench_feedback.py [-o results.json]
+"""
+
+import io
+import sys
+import json
+import argparse
+import traceback
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from rich.console import Console
+
+from aipyapp.aipy.runner import Runner
+from aipyapp.aipy.serialize import compact_result, filter_stats
+from aipyapp.aipy.tokens import estimate_tokens
+
+INSTRUCTION = "读取 data.json，统计每个城市的订单数量和总金额，找出金额最高的三个城市，并把结果保存为 CSV 文件。"
+
+ROUNDS = [
+    ("load", """
+orders = [{'city': f'city{i % 7}', 'amount': i * 3.5} for i in range(200)]
+print(f"loaded {len(orders)} orders")
+__result__ = {'count': len(orders), 'cities': sorted({o['city'] for o in orders})}
+"""),
+    ("aggregate", """
+totals = {}
+for o in orders:
+    totals[o['city']] = totals.get(o['city'], 0) + o['amount']
+top = sorted(totals.items(), key=lambda x: -x[1])[:3]
+__result__ = {'count': len(orders), 'cities': sorted(totals), 'top': top}
+"""),
+    ("error", """
+import json
+config = json.loads("{'city': 'single quotes'}")
+"""),
+    ("save", """
+import csv, io
+buf = io.StringIO()
+csv.writer(buf).writerows(top)
+print(buf.getvalue())
+__result__ = {'count': len(orders), 'cities': sorted(totals), 'top': top, 'rows': [list(r) for r in totals.items()]}
+"""),
+]
+
+def legacy_traceback(code, gs):
+    """ 精简之前的异常堆栈：traceback.format_exc() 的完整输出 """
+    try:
+        exec(code, dict(gs))
+    except Exception:
+        return traceback.format_exc()
+    return None
+
+def measure(text):
+    return {'bytes': len(text.encode('utf-8')), 'tokens': estimate_tokens(text)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Feedback message size benchmark")
+    parser.add_argument('-o', '--output', type=str, default=None, help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    runner = Runner(Console(file=io.StringIO()), {})
+    previous = None
+    results = []
+    for name, code in ROUNDS:
+        gs = dict(runner.globals)
+        result = runner(code)
+
+        legacy = dict(result)
+        if 'traceback' in legacy:
+            legacy['traceback'] = legacy_traceback(code, gs) or legacy['traceback']
+        legacy = json.dumps(legacy, ensure_ascii=False, indent=4)
+        legacy = f"# 最初任务\n{INSTRUCTION}\n\n# 代码执行结果反馈\n{legacy}"
+
+        compact = json.dumps(compact_result(filter_stats(result, 10), previous), ensure_ascii=False, separators=(',', ':'))
+        compact = f"# 代码执行结果反馈\n{compact}"
+        previous = result.get('__result__')
+
+        results.append({'name': name, 'legacy': measure(legacy), 'compact': measure(compact)})
+
+    total = {fmt: {key: sum(r[fmt][key] for r in results) for key in ('bytes', 'tokens')} for fmt in ('legacy', 'compact')}
+    for r in results + [dict(total, name='total')]:
+        saved = 1 - r['compact']['tokens'] / r['legacy']['tokens']
+        print(f"{r['name']:12} {r['legacy']['bytes']:>7} B {r['legacy']['tokens']:>6} tok -> "
+              f"{r['compact']['bytes']:>7} B {r['compact']['tokens']:>6} tok ({saved:.0%} fewer tokens)", file=sys.stderr)
+
+    data = json.dumps({'rounds': results, 'total': total}, indent=2)
+    if args.output:
+        Path(args.output).write_text(data)
+    else:
+        print(data)
+
+if __name__ == '__main__':
+    main()
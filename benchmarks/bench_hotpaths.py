@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Agent 热点路径的微基准测试，结果以 JSON 输出，便于跨版本对比
+
+覆盖：
+- Agent.parse_reply 处理大回复
+- Runner.__call__ 的固定开销（globals 复制、StringIO 捕获、env/session 比较）
+- Runner.filter_result 和 is_json_serializable 处理深层/大结果
+- ChatHistory.get_messages 处理 500 条消息
+- 各客户端的流式解析器处理合成片段
+
+用法:
+    python benchmarks/bench_hotpaths.py [--filter runner] [--scale 1.0] [-o results.json]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import argparse
+import statistics
+from pathlib import Path
+from types import SimpleNamespace as NS
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from rich.console import Console
+
+from aipyapp import __version__
+from aipyapp.aipy.agent import Agent
+from aipyapp.aipy.runner import Runner, is_json_serializable
+from aipyapp.aipy.llm import ChatHistory, OpenAIClient, OllamaClient, ClaudeClient
+
+BENCHMARKS = []
+
+def benchmark(name, number=10, repeat=5):
+    def decorator(func):
+        BENCHMARKS.append((name, func, number, repeat))
+        return func
+    return decorator
+
+def measure(setup, number, repeat):
+    """ setup 返回被测函数；每轮执行 number 次，共 repeat 轮 """
+    func = setup()
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    return times
+
+def make_console():
+    return Console(file=io.StringIO(), record=True, width=120)
+
+def make_reply(size):
+    text = "分析任务并给出下面的代码。" * 20 + "\n\n"
+    body = "\n".join(f"    total += item[{i % 7}] * {i}" for i in range(size))
+    return f"{text * 20}```python\n#RUN\ntotal = 0\nfor item in data:\n{body}\n```\n\n{text * 5}"
+
+def deep_result(depth, fanout):
+    if depth == 0:
+        return {'value': 1.5, 'name': 'leaf', 'flags': [True, False, None]}
+    return {f"k{i}": deep_result(depth - 1, fanout) for i in range(fanout)}
+
+SCALE = 1.0
+
+def scaled(n):
+    return max(1, int(n * SCALE))
+
+@benchmark('agent.parse_reply.large')
+def bench_parse_reply():
+    text = make_reply(scaled(5000))
+    return lambda: Agent.parse_reply(None, text)
+
+@benchmark('runner.call.noop', number=100)
+def bench_runner_noop():
+    runner = Runner(make_console(), {})
+    return lambda: runner("pass")
+
+@benchmark('runner.call.print', number=20)
+def bench_runner_print():
+    runner = Runner(make_console(), {})
+    code = f"for i in range({scaled(10000)}):\n    print(i)"
+    return lambda: runner(code)
+
+@benchmark('runner.call.large_session', number=20)
+def bench_runner_session():
+    runner = Runner(make_console(), {})
+    session = runner.globals['__session__']
+    for i in range(scaled(10000)):
+        session[f"key{i}"] = list(range(20))
+    for i in range(scaled(1000)):
+        runner.setenv(f"ENV{i}", f"value{i}", "desc")
+    return lambda: runner("__session__['counter'] = __session__.get('counter', 0) + 1")
+
+@benchmark('runner.filter_result.deep')
+def bench_filter_deep():
+    runner = Runner(make_console(), {})
+    result = deep_result(6, 4)
+    return lambda: runner.filter_result(json.loads(json.dumps(result)))
+
+@benchmark('runner.filter_result.large_list')
+def bench_filter_list():
+    runner = Runner(make_console(), {})
+    result = {'rows': [{'id': i, 'name': f"row{i}", 'score': i * 0.5} for i in range(scaled(20000))]}
+    return lambda: runner.filter_result(result)
+
+@benchmark('runner.is_json_serializable.large', number=5)
+def bench_is_json():
+    data = {'rows': [list(range(50)) for _ in range(scaled(5000))]}
+    return lambda: is_json_serializable(data)
+
+@benchmark('history.get_messages.500', number=200)
+def bench_get_messages():
+    history = ChatHistory()
+    history.add('system', 'system prompt ' * 500)
+    for i in range(250):
+        history.add('user', f"feedback {i} " * 100)
+        history.add('assistant', f"reply {i} " * 200)
+    return history.get_messages
+
+def stream_tokens():
+    return [tok + ' ' for tok in make_reply(scaled(500)).split(' ')]
+
+def make_client(cls, config):
+    client = cls(dict(config, api_key='fake-api-key'))
+    client.name = 'bench'
+    client.console = make_console()
+    return client
+
+@benchmark('client.openai.parse_stream', number=1, repeat=3)
+def bench_openai_stream():
+    client = make_client(OpenAIClient, {'base_url': 'http://127.0.0.1:1'})
+    chunks = [NS(usage=None, choices=[NS(delta=NS(content=tok))]) for tok in stream_tokens()]
+    return lambda: client._parse_stream_response(iter(chunks))
+
+@benchmark('client.ollama.parse_stream', number=1, repeat=3)
+def bench_ollama_stream():
+    client = make_client(OllamaClient, {'base_url': 'http://127.0.0.1:1'})
+    lines = [json.dumps({'message': {'role': 'assistant', 'content': tok}, 'done': False}).encode() for tok in stream_tokens()]
+    lines.append(json.dumps({'done': True, 'prompt_eval_count': 10, 'eval_count': len(lines)}).encode())
+    response = NS(iter_lines=lambda: iter(lines), close=lambda: None)
+    return lambda: client._parse_stream_response(response)
+
+@benchmark('client.claude.parse_stream', number=1, repeat=3)
+def bench_claude_stream():
+    client = make_client(ClaudeClient, {})
+    events = [NS(delta=NS(text=tok)) for tok in stream_tokens()]
+    events.append(NS(delta=NS(), usage=NS(input_tokens=10, output_tokens=len(events))))
+    return lambda: client._parse_stream_response(iter(events))
+
+def main():
+    global SCALE
+    parser = argparse.ArgumentParser(description="Micro benchmarks for agent hot paths")
+    parser.add_argument('--filter', type=str, default=None, help="Only run benchmarks whose name contains this string")
+    parser.add_argument('--scale', type=float, default=1.0, help="Scale factor for input sizes")
+    parser.add_argument('-o', '--output', type=str, default=None, help="Write JSON results to this file")
+    args = parser.parse_args()
+    SCALE = args.scale
+    output = Path(args.output).resolve() if args.output else None
+    # Runner 会统计当前目录(任务目录)的写入量，在空目录里运行
+    os.chdir(tempfile.mkdtemp())
+
+    results = []
+    for name, setup, number, repeat in BENCHMARKS:
+        if args.filter and args.filter not in name:
+            continue
+        times = measure(setup, number, repeat)
+        results.append({
+            'name': name,
+            'number': number,
+            'repeat': repeat,
+            'min_us': round(min(times) * 1e6, 2),
+            'median_us': round(statistics.median(times) * 1e6, 2),
+            'mean_us': round(statistics.mean(times) * 1e6, 2),
+        })
+        print(f"{name:40} {results[-1]['median_us']:>14.2f} us", file=sys.stderr)
+
+    report = {
+        'version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': SCALE,
+        'results': results,
+    }
+    data = json.dumps(report, indent=2)
+    if output:
+        output.write_text(data)
+    else:
+        print(data)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+回放一段流式回复，测量 StreamRenderer 每个片段的 CPU 时间
+
+用法:
+    python benchmarks/bench_render.py [--record chunks.json] [--tokens 20000] [--naive 2000]
+
+--record 指定录制的片段文件（JSON 字符串列表），否则生成一段约 20k token 的 Markdown 回复。
+--naive 同时用旧的“每片段重建 Markdown”方式回放前 N 个片段作对比。
+"""
+
+import io
+import sys
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from rich.live import Live
+from rich.panel import Panel
+from rich.console import Console
+from rich.markdown import Markdown
+
+from aipyapp.aipy.render import StreamRenderer
+
+WORDS = "the agent runs python code and sends the result back to the model for analysis".split()
+
+CODE = """\
+```python
+#RUN
+import json
+import requests
+
+def fetch(url):
+    resp = requests.get(url, timeout=10)
+    resp.raise_for_status()
+    return resp.json()
+
+__result__ = {'data': fetch('https://example.com/api')}
+```
+"""
+
+def make_reply(tokens, seed=0):
+    rnd = random.Random(seed)
+    parts = []
+    count = 0
+    while count < tokens:
+        kind = rnd.random()
+        if kind < 0.2:
+            parts.append(CODE)
+        elif kind < 0.4:
+            items = [f"- {' '.join(rnd.choices(WORDS, k=8))}" for _ in range(5)]
+            parts.append('\n'.join(items) + '\n')
+        else:
+            parts.append(' '.join(rnd.choices(WORDS, k=60)) + '\n')
+        parts.append('\n')
+        count = sum(len(p) for p in parts) // 4
+    text = ''.join(parts)
+    return [text[i:i+4] for i in range(0, len(text), 4)]
+
+def make_console():
+    return Console(file=io.StringIO(), width=120, force_terminal=True, record=True)
+
+def run_renderer(chunks):
+    console = make_console()
+    start = time.process_time()
+    with StreamRenderer(console, 'bench') as renderer:
+        for chunk in chunks:
+            renderer.feed(chunk)
+    return time.process_time() - start
+
+def run_naive(chunks):
+    console = make_console()
+    start = time.process_time()
+    full_response = ""
+    with Live(console=console, auto_refresh=True, vertical_overflow='visible') as live:
+        for chunk in chunks:
+            full_response += chunk
+            live.update(Panel(Markdown(full_response), title='bench', border_style="green"))
+    return time.process_time() - start
+
+def report(name, cpu, chunks):
+    return {
+        'name': name,
+        'chunks': chunks,
+        'cpu_seconds': round(cpu, 4),
+        'cpu_us_per_chunk': round(cpu / chunks * 1e6, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="StreamRenderer benchmark")
+    parser.add_argument('--record', type=str, default=None, help="JSON list of recorded chunks")
+    parser.add_argument('--tokens', type=int, default=20000, help="Synthetic reply size in tokens")
+    parser.add_argument('--naive', type=int, default=0, help="Also replay the first N chunks with the naive renderer")
+    args = parser.parse_args()
+
+    if args.record:
+        chunks = json.loads(Path(args.record).read_text(encoding='utf-8'))
+    else:
+        chunks = make_reply(args.tokens)
+
+    results = [report('stream_renderer', run_renderer(chunks), len(chunks))]
+    if args.naive:
+        prefix = chunks[:args.naive]
+        results.append(report('stream_renderer_prefix', run_renderer(prefix), len(prefix)))
+        results.append(report('naive_prefix', run_naive(prefix), len(prefix)))
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+启动时间基准测试，每项在新的 Python 进程里运行若干次，取中位数
+
+- help: python -m aipyapp --help
+- import: import aipyapp.aipy，同时检查没有导入 LLM SDK、term_image、sqlite3 和 render
+- first_prompt: 从进程启动到收到模拟 LLM 服务的第一个回复
+
+超过 --max-help / --max-first-prompt 或导入了不该导入的模块时返回 1，可以在 CI 里防止启动变慢。
+
+用法:
+    python benchmarks/bench_startup.py [--runs 5] [--max-help 1.0] [--max-first-prompt 3.0] [-o results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import platform
+import statistics
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# 启动时不应该导入的模块，只在使用对应功能时导入
+LAZY_MODULES = ['openai', 'anthropic', 'requests', 'httpx', 'term_image', 'sqlite3', 'aipyapp.aipy.render']
+
+IMPORT_CHECK = f"""
+import sys
+import aipyapp.aipy
+print(' '.join(name for name in {LAZY_MODULES!r} if name in sys.modules))
+"""
+
+FIRST_PROMPT = """
+import io, os, sys, time
+start = time.perf_counter()
+from rich.console import Console
+from aipyapp.aipy import Agent
+from aipyapp.aipy.config import ConfigManager
+imported = time.perf_counter()
+settings = ConfigManager(sys.argv[1], sys.argv[2]).get_config()
+ai = Agent(settings, console=Console(file=io.StringIO(), record=True))
+created = time.perf_counter()
+ai.llm('benchmark', system_prompt=ai.system_prompt)
+replied = time.perf_counter()
+print(f"{imported - start} {created - imported} {replied - created}")
+"""
+
+def env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(ROOT), env.get('PYTHONPATH')]))
+    return env
+
+def run(args, cwd=None):
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable] + args, cwd=cwd, env=env(), capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode:
+        raise RuntimeError(f"{' '.join(args)} failed:\n{proc.stderr}")
+    return elapsed, proc.stdout
+
+def median(values):
+    return round(statistics.median(values), 4)
+
+def bench_help(runs):
+    return {'name': 'help', 'median_s': median([run(['-m', 'aipyapp', '--help'])[0] for _ in range(runs)])}
+
+def bench_import(runs):
+    times = []
+    for _ in range(runs):
+        elapsed, output = run(['-c', IMPORT_CHECK])
+        times.append(elapsed)
+    return {'name': 'import', 'median_s': median(times), 'lazy_modules_imported': output.split()}
+
+def bench_first_prompt(runs):
+    from aipyapp.aipy.fakellm import FakeLLMServer
+
+    server = FakeLLMServer().start()
+    workdir = tempfile.mkdtemp()
+    user_config = Path(workdir) / 'aipython.toml'
+    user_config.write_text(f"""
+workdir = "{workdir}"
+
+[llm.bench]
+api_key = "fake-api-key"
+base_url = "{server.url}/v1"
+model = "fake"
+default = true
+""")
+    default_config = str(ROOT / 'aipyapp' / 'default.toml')
+    times, phases = [], []
+    try:
+        for _ in range(runs):
+            elapsed, output = run(['-c', FIRST_PROMPT, default_config, str(user_config)], cwd=workdir)
+            times.append(elapsed)
+            phases.append([float(value) for value in output.split()[-3:]])
+    finally:
+        server.stop()
+    imported, created, replied = zip(*phases)
+    return {
+        'name': 'first_prompt',
+        'median_s': median(times),
+        'import_s': median(imported),
+        'agent_init_s': median(created),
+        'first_reply_s': median(replied),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time benchmark")
+    parser.add_argument('--runs', type=int, default=5, help="Runs per benchmark")
+    parser.add_argument('--max-help', type=float, default=None, help="Fail if `aipy --help` takes longer (seconds)")
+    parser.add_argument('--max-first-prompt', type=float, default=None, help="Fail if the first prompt takes longer (seconds)")
+    parser.add_argument('-o', '--output', type=str, default=None, help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    results = [bench_help(args.runs), bench_import(args.runs), bench_first_prompt(args.runs)]
+    for result in results:
+        print(f"{result['name']:20} {result['median_s']:>10.4f} s", file=sys.stderr)
+
+    failures = []
+    help_time, import_result, first_prompt = results
+    if args.max_help and help_time['median_s'] > args.max_help:
+        failures.append(f"aipy --help took {help_time['median_s']}s > {args.max_help}s")
+    if args.max_first_prompt and first_prompt['median_s'] > args.max_first_prompt:
+        failures.append(f"first prompt took {first_prompt['median_s']}s > {args.max_first_prompt}s")
+    if import_result['lazy_modules_imported']:
+        failures.append(f"import aipyapp.aipy imported: {' '.join(import_result['lazy_modules_imported'])}")
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+        'failures': failures,
+    }
+    data = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(data)
+    else:
+        print(data)
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
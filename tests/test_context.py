@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import unittest
+
+from rich.console import Console
+
+from aipyapp.aipy.llm import ChatHistory, ChatMessage, OpenAIClient, count_message_tokens
+
+def add_round(history, code):
+    history.add_message(ChatMessage(role='assistant', content='运行代码', tool_call={'id': f'call_{len(history)}', 'name': 'execute_python', 'code': code}))
+    history.add('user', '{"stdout": "ok"}', kind='feedback')
+
+def payload_tokens(messages):
+    return sum(count_message_tokens(msg['content'], msg.get('tool_call')) for msg in messages)
+
+class ContextBudgetTest(unittest.TestCase):
+    def make_history(self, budget=0):
+        history = ChatHistory(budget=budget, keep_rounds=1)
+        history.add('system', '你是一个助手')
+        history.add('user', '分析数据')
+        for i in range(6):
+            add_round(history, f"# 第 {i} 段代码\n" + "print('x' * 80)\n" * 400)
+        return history
+
+    def test_large_tool_calls_fit_budget(self):
+        history = self.make_history(budget=8000)
+        self.assertGreater(history.context_tokens, 8000)
+        messages = history.get_messages()
+        self.assertLessEqual(payload_tokens(messages), 8000)
+        # 缩减的是较早的工具调用代码，最近一轮原样保留
+        self.assertIn('# ...', messages[2]['tool_call']['code'])
+        self.assertEqual(messages[-2]['tool_call']['code'], history.messages[-2].tool_call['code'])
+        self.assertEqual(messages[2]['tool_call']['id'], history.messages[2].tool_call['id'])
+
+    def test_client_payload_fits_limit(self):
+        client = OpenAIClient({'api_key': 'k', 'model': 'm', 'tools': True, 'context_window': 12000, 'max_tokens': 2000})
+        client.console = Console(file=io.StringIO())
+        history = self.make_history()
+        messages = client.prepare_messages(history)
+        self.assertIsNotNone(messages)
+        self.assertLessEqual(client.estimate_tokens(messages), client.get_input_limit())
+        payload = client.format_messages(messages)
+        self.assertTrue(any(msg.get('tool_calls') for msg in payload))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from contextlib import contextmanager
+
+from rich.console import Console
+
+from aipyapp.aipy import Agent
+from aipyapp.aipy.config import ConfigManager
+from aipyapp.aipy.fakellm import FakeLLMServer, Transcripts
+
+DEFAULT_CONFIG = Path(__file__).resolve().parent.parent / 'aipyapp' / 'default.toml'
+
+def code_reply(code):
+    return f"```python\n#RUN\n{code}\n```"
+
+TASK = {'llm': [
+    {'role': 'user', 'content': 'resume session'},
+    {'role': 'assistant', 'content': code_reply("__session__['n'] = 41\n__result__ = {'n': 41}")},
+    {'role': 'user', 'content': 'feedback'},
+    {'role': 'assistant', 'content': code_reply("__result__ = {'n': __session__.get('n', 0) + 1}")},
+    {'role': 'user', 'content': 'feedback'},
+    {'role': 'assistant', 'content': 'done'},
+]}
+
+@contextmanager
+def quiet_stdout():
+    """ Agent 会向 fd 1 写入提示音 """
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        yield
+    finally:
+        os.dup2(saved, 1)
+        os.close(devnull)
+        os.close(saved)
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.server = FakeLLMServer(Transcripts([TASK])).start()
+        self.workdir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.server.stop()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def make_agent(self, sandbox):
+        config = self.workdir / 'aipy.toml'
+        config.write_text(f"""
+workdir = "{self.workdir}"
+[sandbox]
+enable = {'true' if sandbox else 'false'}
+[llm.fake]
+type = "openai"
+api_key = "fake-api-key"
+base_url = "{self.server.url}/v1"
+model = "fake"
+default = true
+""")
+        os.chdir(self.workdir)
+        settings = ConfigManager(str(DEFAULT_CONFIG), str(config)).get_config()
+        return Agent(settings, console=Console(file=io.StringIO(), record=True))
+
+    def resume_second_block(self, sandbox):
+        """ 运行完整的任务，然后从第二段代码还没有执行的位置恢复 """
+        ai = self.make_agent(sandbox)
+        with quiet_stdout():
+            ai('resume session')
+            task_id = ai.task_id
+            ai.done()
+        events = (self.workdir / task_id / 'events.jsonl').read_text().splitlines()
+        events = [json.loads(line) for line in events]
+        replies = [i for i, event in enumerate(events) if event['type'] == 'message' and event['message']['role'] == 'assistant']
+        path = self.workdir / 'resumed'
+        path.mkdir()
+        (path / 'events.jsonl').write_text(''.join(json.dumps(event) + '\n' for event in events[:replies[1] + 1]))
+
+        ai = self.make_agent(sandbox)
+        with quiet_stdout():
+            ai.resume('resumed')
+            ai.done()
+        task = json.loads((path / 'task.json').read_text())
+        return task['runner'][2]['result']['__result__']
+
+    def test_resume_restores_session(self):
+        self.assertEqual(self.resume_second_block(sandbox=False), {'n': 42})
+
+    def test_resume_restores_session_in_subprocess(self):
+        self.assertEqual(self.resume_second_block(sandbox=True), {'n': 42})
+
+if __name__ == '__main__':
+    unittest.main()